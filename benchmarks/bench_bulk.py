@@ -0,0 +1,71 @@
+#Замер массовой выгрузки и загрузки записей (cli.py export / import)
+#python benchmarks/bench_bulk.py --rows 1000000 3000000 --workers 1 4
+#
+#База SQLite заполняется сгенерированными записями, затем выгружается в CSV,
+#CSV.GZ и колоночный формат и загружается обратно в пустую базу. Для каждого
+#формата выводятся строки/сек в обе стороны, размер файла и совпадение
+#загруженных записей с исходными
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bulk import FORMATS, export_rows, import_rows, read_rows
+from storage import STATUS_CONFIRMED, STATUS_PENDING, SQLiteStorage
+
+DAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+def generate_rows(count):
+    """Генерирует записи без хранения их в памяти"""
+    for i in range(count):
+        status = STATUS_PENDING if i % 3 else STATUS_CONFIRMED
+        start = 9 + i % 10
+        yield (
+            DAYS[i % 7], f"{start}:00-{start + 2}:00", f"Клиент {i}", str(100000 + i),
+            f"+7999{i:07d}", "Тревога, проблемы со сном" if i % 2 else "-", status
+        )
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер массовой выгрузки и загрузки записей")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--formats", nargs="+", choices=[name for name in FORMATS if name != "xlsx"],
+                        default=["csv", "csv.gz", "columnar"])
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"ядер: {os.cpu_count()}")
+    print("строк\tформат\tпотоков\tвыгрузка, строк/сек\tфайл, МБ\tзагрузка, строк/сек\tсовпадает")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = SQLiteStorage(os.path.join(tmp, "source.db"))
+            import_rows(source, generate_rows(rows))
+            for file_format in args.formats:
+                for workers in args.workers:
+                    file_path = os.path.join(tmp, "export" + FORMATS[file_format])
+                    exported, export_elapsed = timed(export_rows, source.iter_rows(), file_path, file_format, workers=workers)
+                    size_mb = os.path.getsize(file_path) / 1024 / 1024
+
+                    target = SQLiteStorage(os.path.join(tmp, f"target-{file_format}-{workers}.db"))
+                    imported, import_elapsed = timed(import_rows, target, read_rows(file_path, file_format))
+                    same = all(a == b for a, b in zip(source.iter_rows(), target.iter_rows())) and exported == imported == rows
+                    target.close()
+                    os.remove(target.db_path)
+                    print(
+                        f"{rows}\t{file_format}\t{workers}\t{exported / export_elapsed:.0f}\t{size_mb:.1f}\t"
+                        f"{imported / import_elapsed:.0f}\t{'да' if same else 'нет'}"
+                    )
+            source.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#Масштабирование по процессам: полный диалог записи через cluster.Cluster
+#python benchmarks/bench_cluster.py --users 2000 --workers 1 2 4
+#
+#Обновления диалога (как в bench_dialog.py) подаются маршрутизатору, рабочие
+#процессы отвечают через заглушку Bot API. Замеряется время от первого
+#обновления до обработки последнего и число записей в хранилище после прогона.
+#Ускорение близко к линейному, пока число процессов не превышает число ядер
+
+import argparse
+import asyncio
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_dialog import dialog_script
+
+def install_stub(main):
+    """Подменяет сессию бота в рабочем процессе заглушкой без сетевых запросов"""
+    import logging
+
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage
+    from aiogram.types import Chat, Message
+
+    logging.disable(logging.INFO)
+    latency = float(os.getenv("BENCH_API_LATENCY", "0")) / 1000
+
+    class StubSession(BaseSession):
+        async def make_request(self, bot, method, timeout=None):
+            if latency:
+                await asyncio.sleep(latency)
+            if isinstance(method, SendMessage):
+                return Message(
+                    message_id=1, date=datetime.datetime.now(),
+                    chat=Chat(id=method.chat_id, type="private"), text=method.text
+                )
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    main.bot.session = StubSession()
+
+def make_updates(users):
+    """Обновления в формате Bot API, по шагу диалога каждого пользователя по очереди"""
+    scripts = [(1_000_000 + i, dialog_script(1_000_000 + i)) for i in range(users)]
+    update_id = 0
+    date = int(time.time())
+    updates = []
+    for step in range(max(len(script) for _, script in scripts)):
+        for user_id, script in scripts:
+            if step < len(script):
+                update_id += 1
+                _, text, callback_data = script[step]
+                user = {"id": user_id, "is_bot": False, "first_name": "Клиент"}
+                chat = {"id": user_id, "type": "private"}
+                if callback_data is not None:
+                    updates.append({"update_id": update_id, "callback_query": {
+                        "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": callback_data,
+                        "message": {"message_id": 1, "date": date, "chat": chat, "text": "📅"},
+                    }})
+                    continue
+                updates.append({"update_id": update_id, "message": {
+                    "message_id": update_id, "date": date, "from": user, "chat": chat, "text": text,
+                }})
+    return updates
+
+def run(workers, updates, tmp):
+    from cluster import Cluster
+
+    cluster = Cluster(workers, setup=install_stub)
+    cluster.start()
+    started = time.perf_counter()
+    for update in updates:
+        cluster.route(update)
+    handled = cluster.stop()
+    elapsed = time.perf_counter() - started
+    bookings = sqlite3.connect(os.path.join(tmp, "appointments.db")).execute("SELECT COUNT(*) FROM appointments").fetchone()[0]
+    return sum(handled.values()) / elapsed, bookings
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование диалога записи по процессам")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--api-latency", type=float, default=0, help="задержка заглушки Bot API, мс")
+    args = parser.parse_args()
+
+    updates = make_updates(args.users)
+    print(f"ядер: {os.cpu_count()}, обновлений: {len(updates)}")
+    print("процессов\tобновлений/сек\tускорение\tзаписей")
+    baseline = None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ.update({
+                "TELEGRAM_TOKEN": "123456:" + "A" * 35,
+                "ADMIN_ID": "1",
+                "STORAGE_BACKEND": "sqlite",
+                "SQLITE_FILE": os.path.join(tmp, "appointments.db"),
+                "NOTIFY_DB_FILE": os.path.join(tmp, "notifications.db"),
+                "REMINDER_DB_FILE": os.path.join(tmp, "reminders.db"),
+                "FSM_DB_FILE": os.path.join(tmp, "fsm.db"),
+                "BENCH_API_LATENCY": str(args.api_latency),
+            })
+            rate, bookings = run(workers, updates, tmp)
+        baseline = baseline or rate
+        print(f"{workers}\t{rate:.0f}\t{rate / baseline:.2f}x\t{bookings}")
+
+if __name__ == "__main__":
+    main()
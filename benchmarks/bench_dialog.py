@@ -0,0 +1,202 @@
+#Нагрузочный тест полного диалога записи без обращения к Telegram
+#python benchmarks/bench_dialog.py --users 2000 --storage excel excel-resident sqlite --fsm memory sqlite
+#
+#Каждая комбинация хранилищ запускается в отдельном процессе с временными файлами.
+#Синтетические обновления подаются в dp.feed_update, запросы к Bot API
+#обрабатывает заглушка сессии. Все пользователи проходят диалог одновременно
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keyboards import DayPick
+
+STORAGE_ENV = {
+    "excel": {"STORAGE_BACKEND": "excel"},
+    "excel-resident": {"STORAGE_BACKEND": "excel", "EXCEL_RESIDENT": "1"},
+    "sqlite": {"STORAGE_BACKEND": "sqlite"},
+}
+
+def dialog_script(user_id):
+    """Шаги диалога одного пользователя: (название шага, текст сообщения, данные нажатой inline-кнопки)"""
+    days = [user_id % 7, (user_id + 3) % 7]
+    steps = [
+        ("start", "/start", None),
+        ("book", "📅 Записаться на прием", None),
+        ("name", f"Клиент {user_id}", None),
+        ("phone", f"+7999{user_id:07d}", None),
+        ("situation", "-", None),
+    ]
+    steps += [("day", None, DayPick(action="toggle", day=day).pack()) for day in days]
+    steps.append(("days_done", None, DayPick(action="done").pack()))
+    steps += [("time", time_range, None) for time_range in ("9:00-12:00", "14:00-16:00")]
+    return steps
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def run_child(args):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+    import main
+
+    api_calls = Counter()
+
+    class StubSession(BaseSession):
+        """Заглушка Bot API: отвечает успехом без сетевых запросов"""
+        async def make_request(self, bot, method, timeout=None):
+            api_calls[type(method).__name__] += 1
+            if args.api_latency:
+                await asyncio.sleep(args.api_latency / 1000)
+            if isinstance(method, SendMessage):
+                return Message(
+                    message_id=1, date=datetime.datetime.now(),
+                    chat=Chat(id=method.chat_id, type="private"), text=method.text
+                )
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    main.bot.session = StubSession()
+    update_ids = itertools.count(1)
+    now = datetime.datetime.now()
+
+    def make_update(user_id, text, callback_data):
+        update_id = next(update_ids)
+        user = User(id=user_id, is_bot=False, first_name="Клиент")
+        chat = Chat(id=user_id, type="private")
+        if callback_data is not None:
+            # Нажатие кнопки под сообщением бота с выбором дней
+            return Update(update_id=update_id, callback_query=CallbackQuery(
+                id=str(update_id), from_user=user, chat_instance=str(user_id), data=callback_data,
+                message=Message(message_id=1, date=now, chat=chat, text="📅")
+            ))
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id, date=now, chat=chat, from_user=user, text=text
+        ))
+
+    latencies = {}
+    completed = 0
+
+    async def run_user(user_id):
+        nonlocal completed
+        for step, text, callback_data in dialog_script(user_id):
+            update = make_update(user_id, text, callback_data)
+            started = time.perf_counter()
+            await main.dp.feed_update(main.bot, update)
+            latencies.setdefault(step, []).append(time.perf_counter() - started)
+        completed += 1
+
+    main.booking_writer.start()
+    await main.booking_writer.submit(main.booking_storage.load)
+    main.notifier.start()
+    await main.dp.emit_startup(bot=main.bot)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(1_000_000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    await main.dp.emit_shutdown(bot=main.bot)
+    await main.notifier.stop()
+    await main.booking_writer.submit(main.booking_storage.close)
+    await main.booking_writer.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    result = {
+        "users": args.users,
+        "updates": len(all_latencies),
+        "seconds": elapsed,
+        "bookings_per_sec": completed / elapsed,
+        "updates_per_sec": len(all_latencies) / elapsed,
+        "p50_ms": percentile(all_latencies, 50) * 1000,
+        "p99_ms": percentile(all_latencies, 99) * 1000,
+        "steps": {
+            step: {"p50_ms": percentile(values, 50) * 1000, "p99_ms": percentile(values, 99) * 1000}
+            for step, values in latencies.items()
+        },
+        "api_calls": dict(api_calls),
+        "api_calls_per_booking": sum(api_calls.values()) / max(completed, 1),
+        "messages_per_booking": api_calls["SendMessage"] / max(completed, 1),
+        # ru_maxrss в Linux измеряется в килобайтах
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    print(json.dumps(result))
+
+def run_config(args, storage, fsm):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update(STORAGE_ENV[storage])
+        env.update({
+            "TELEGRAM_TOKEN": "123456:" + "A" * 35,
+            "ADMIN_ID": "1",
+            "FSM_STORAGE": fsm,
+            "EXCEL_FILE": os.path.join(tmp, "appointments.xlsx"),
+            "SQLITE_FILE": os.path.join(tmp, "appointments.db"),
+            "FSM_DB_FILE": os.path.join(tmp, "fsm.db"),
+            "NOTIFY_DB_FILE": os.path.join(tmp, "notifications.db"),
+            "REMINDER_DB_FILE": os.path.join(tmp, "reminders.db"),
+        })
+        command = [
+            sys.executable, __file__, "--child",
+            "--users", str(args.users), "--api-latency", str(args.api_latency)
+        ]
+        completed = subprocess.run(command, env=env, cwd=tmp, capture_output=True, text=True)
+        if completed.returncode:
+            sys.stderr.write(completed.stderr)
+            raise SystemExit(f"Прогон {storage}/{fsm} завершился с ошибкой")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест диалога записи")
+    parser.add_argument("--users", type=int, default=1000, help="число одновременных пользователей")
+    parser.add_argument("--storage", nargs="+", choices=sorted(STORAGE_ENV), default=["excel", "excel-resident", "sqlite"])
+    parser.add_argument("--fsm", nargs="+", choices=["memory", "sqlite"], default=["memory"])
+    parser.add_argument("--api-latency", type=float, default=0, help="задержка заглушки Bot API, мс")
+    parser.add_argument("--json", action="store_true", help="вывести полные результаты в JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        import logging
+        logging.disable(logging.INFO)
+        asyncio.run(run_child(args))
+        return
+
+    results = []
+    print("хранилище\tFSM\tзаписей/сек\tобновлений/сек\tp50, мс\tp99, мс\tзапросов API/запись\tсообщений/запись\tпиковый RSS, МБ")
+    for storage in args.storage:
+        for fsm in args.fsm:
+            result = run_config(args, storage, fsm)
+            result.update(storage=storage, fsm=fsm)
+            results.append(result)
+            print(
+                f"{storage}\t{fsm}\t{result['bookings_per_sec']:.1f}\t{result['updates_per_sec']:.0f}\t"
+                f"{result['p50_ms']:.2f}\t{result['p99_ms']:.2f}\t"
+                f"{result['api_calls_per_booking']:.1f}\t{result['messages_per_booking']:.1f}\t{result['peak_rss_mb']:.0f}"
+            )
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#Замер потоковой выгрузки в Excel
+#python benchmarks/bench_export.py --rows 10000 100000 1000000
+#
+#Каждый замер выполняется в отдельном процессе, чтобы пиковый RSS
+#одного прогона не влиял на следующий
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import HEADERS, STATUS_PENDING, export_to_excel, new_workbook
+
+DAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+def generate_rows(count):
+    """Генерирует записи без хранения их в памяти"""
+    for i in range(count):
+        status = STATUS_PENDING if i % 3 else "Подтверждено"
+        yield (DAYS[i % 7], "9:00-12:00", f"Клиент {i}", str(100000 + i), "+79990000000", "", status)
+
+def export_in_memory(rows, file_path):
+    """Выгрузка через обычную книгу openpyxl (для сравнения)"""
+    wb = new_workbook()
+    ws = wb.active
+    for row in rows:
+        ws.append(row)
+    wb.save(file_path)
+
+def peak_rss_mb():
+    # ru_maxrss в Linux измеряется в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_child(rows, mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, "export.xlsx")
+        baseline = peak_rss_mb()
+        started = time.perf_counter()
+        if mode == "streaming":
+            export_to_excel(generate_rows(rows), file_path)
+        else:
+            export_in_memory(generate_rows(rows), file_path)
+        elapsed = time.perf_counter() - started
+        size_mb = os.path.getsize(file_path) / 1024 / 1024
+    print(f"{mode}\t{rows}\t{elapsed:.1f}\t{rows / elapsed:.0f}\t{peak_rss_mb() - baseline:.1f}\t{size_mb:.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер потоковой выгрузки записей в Excel")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--mode", choices=["streaming", "in_memory"], nargs="+", default=["streaming"])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.rows[0], args.mode[0])
+        return
+
+    print(f"колонок: {len(HEADERS)}")
+    print("режим\tстрок\tсек\tстрок/сек\tприрост RSS, МБ\tфайл, МБ")
+    for mode in args.mode:
+        for rows in args.rows:
+            result = subprocess.run(
+                [sys.executable, __file__, "--child", "--rows", str(rows), "--mode", mode],
+                capture_output=True, text=True, check=True
+            )
+            print(result.stdout.strip())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#Замер подготовки ответов в цикле выбора дней
+#python benchmarks/bench_keyboards.py --replies 20000
+#
+#Сравнивает создание inline-клавиатуры выбора дней на каждое нажатие и полную
+#сериализацию сессией aiogram с готовыми клавиатурами get_days_picker_keyboard и
+#их кешированным JSON. Сетевые запросы не выполняются: замеряется создание
+#EditMessageReplyMarkup и формы запроса
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import EditMessageReplyMarkup
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from keyboards import STATIC_KEYBOARDS, DayPick, get_days_picker_keyboard
+from schedule import WEEKDAYS
+from session import BotSession
+
+def build_days_picker(selected_days):
+    """Клавиатура выбора дней, создаваемая заново на каждое нажатие"""
+    def button(index):
+        mark = "✅ " if WEEKDAYS[index] in selected_days else ""
+        return InlineKeyboardButton(
+            text=f"{mark}{WEEKDAYS[index]}", callback_data=DayPick(action="toggle", day=index).pack()
+        )
+
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [button(0), button(1)],
+        [button(2), button(3)],
+        [button(4), button(5)],
+        [button(6)],
+        [InlineKeyboardButton(text="✅ Завершить выбор дней", callback_data=DayPick(action="done").pack())],
+        [InlineKeyboardButton(text="↩️ В главное меню", callback_data=DayPick(action="menu").pack())]
+    ])
+
+def form_fields(form):
+    return {options["name"]: value for options, _, value in form._fields}
+
+def run(session, bot, keyboard_factory, replies):
+    selected = []
+    started = time.perf_counter()
+    for i in range(replies):
+        day = WEEKDAYS[i % 7]
+        if day in selected:
+            selected.remove(day)
+        else:
+            selected.append(day)
+        method = EditMessageReplyMarkup(chat_id=1, message_id=1, reply_markup=keyboard_factory(selected))
+        session.build_form_data(bot, method)
+    return replies / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер подготовки ответов с клавиатурой выбора дней")
+    parser.add_argument("--replies", type=int, default=20000)
+    args = parser.parse_args()
+
+    bot = Bot(token="123456:" + "A" * 35)
+    plain_session = AiohttpSession()
+    cached_session = BotSession(static_markups=STATIC_KEYBOARDS)
+
+    # Готовая клавиатура и кешированная сериализация должны давать ту же форму
+    selected = ["Вторник", "Пятница"]
+    assert form_fields(plain_session.build_form_data(
+        bot, EditMessageReplyMarkup(chat_id=1, message_id=1, reply_markup=build_days_picker(selected))
+    )) == form_fields(cached_session.build_form_data(
+        bot, EditMessageReplyMarkup(chat_id=1, message_id=1, reply_markup=get_days_picker_keyboard(selected))
+    ))
+
+    before = run(plain_session, bot, build_days_picker, args.replies)
+    after = run(cached_session, bot, get_days_picker_keyboard, args.replies)
+    print(f"новая клавиатура на каждое нажатие: {before:.0f} ответов/сек")
+    print(f"готовая клавиатура и кешированный JSON: {after:.0f} ответов/сек")
+    print(f"ускорение: {after / before:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#Замер планировщика напоминаний
+#python benchmarks/bench_reminders.py --reminders 50000 --idle 5
+#
+#Планирует напоминания в будущем, измеряет время загрузки кучи при запуске
+#и процессорное время в простое, затем переносит часть сроков в прошлое и
+#замеряет скорость отправки. Вместо очереди уведомлений используется заглушка
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reminders import ReminderScheduler
+
+class StubNotifier:
+    def __init__(self):
+        self.count = 0
+
+    async def enqueue(self, chat_id, text, reply_markup=None):
+        self.count += 1
+
+async def run(args, db_path):
+    notifier = StubNotifier()
+    scheduler = ReminderScheduler(notifier, db_path)
+    now = time.time()
+    started = time.perf_counter()
+    for i in range(args.reminders):
+        await scheduler.add(now + 3600 + i, i, 1_000_000 + i, "⏰ Напоминание")
+    added = time.perf_counter() - started
+    await scheduler.stop()
+
+    # Новый экземпляр, как после перезапуска бота
+    scheduler = ReminderScheduler(notifier, db_path)
+    started = time.perf_counter()
+    scheduler.start()
+    loaded = time.perf_counter() - started
+
+    cpu_before = time.process_time()
+    await asyncio.sleep(args.idle)
+    idle_cpu = time.process_time() - cpu_before
+
+    # Делаем сроки наступившими: перестраиваем кучу так, как если бы время прошло
+    due = min(args.due, args.reminders)
+    scheduler.heap = [(now - 1 if i < due else due_at, reminder_id) for i, (due_at, reminder_id) in enumerate(sorted(scheduler.heap))]
+    started = time.perf_counter()
+    scheduler.wakeup.set()
+    while notifier.count < due:
+        await asyncio.sleep(0.01)
+    sent = time.perf_counter() - started
+    await scheduler.stop()
+
+    print(f"планирование: {args.reminders / added:.0f} напоминаний/сек")
+    print(f"загрузка кучи при запуске ({args.reminders}): {loaded * 1000:.1f} мс")
+    print(f"процессорное время в простое за {args.idle:.0f} с: {idle_cpu * 1000:.1f} мс")
+    print(f"отправка наступивших ({due}): {due / sent:.0f} напоминаний/сек")
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер планировщика напоминаний")
+    parser.add_argument("--reminders", type=int, default=50000)
+    parser.add_argument("--due", type=int, default=10000, help="сколько напоминаний сделать наступившими")
+    parser.add_argument("--idle", type=float, default=5, help="длительность простоя, с")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, os.path.join(tmp, "reminders.db")))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#Замер пула соединений сессии Bot API на локальном сервере-заглушке
+#python benchmarks/bench_session.py --requests 2000 --concurrency 200 --limits 10 50 100
+#
+#Поднимает на localhost сервер, который отвечает на sendMessage как Bot API с
+#задержкой --latency, и отправляет через BotSession (BOT_API_URL указывает на
+#заглушку) пачки сообщений с разным размером пула. Для каждого размера
+#выводятся сообщения/сек, задержка запросов, ожидание свободного соединения
+#и доля повторно использованных соединений (keep-alive)
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot
+from aiohttp import web
+
+from session import BotSession, api_server
+
+async def send_message(request):
+    await asyncio.sleep(request.app["latency"])
+    data = await request.post()
+    return web.json_response({"ok": True, "result": {
+        "message_id": 1, "date": int(time.time()), "text": data["text"],
+        "chat": {"id": int(data["chat_id"]), "type": "private"},
+    }})
+
+async def start_stub(latency, port):
+    app = web.Application()
+    app["latency"] = latency
+    app.router.add_post("/bot{token}/sendMessage", send_message)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+async def run(limit, keepalive, requests, concurrency, port):
+    session = BotSession(
+        api=api_server(f"http://127.0.0.1:{port}"), limit=limit,
+        keepalive_timeout=keepalive if keepalive else None,
+    )
+    if not keepalive:
+        # Без keep-alive каждое соединение закрывается после ответа
+        session._connector_init["force_close"] = True
+        session._connector_init.pop("keepalive_timeout")
+    bot = Bot(token="123456:" + "A" * 35, session=session)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.send_message(chat_id=1000 + i, text=f"Сообщение {i}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    stats = session.stats()
+    await session.close()
+    latencies.sort()
+    reused = stats["connections"]["reused"] / max(1, sum(stats["connections"].values()))
+    return (
+        requests / elapsed, statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99)] * 1000,
+        stats["peak_in_flight"], stats["pool_waits"], reused
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description="Замер пула соединений сессии Bot API")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200, help="одновременно отправляемых сообщений")
+    parser.add_argument("--limits", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--latency", type=float, default=50, help="задержка ответа заглушки, мс")
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+
+    runner = await start_stub(args.latency / 1000, args.port)
+    print(f"запросов: {args.requests}, одновременно: {args.concurrency}, задержка заглушки: {args.latency:.0f} мс")
+    print("пул\tkeep-alive\tсообщений/сек\tp50, мс\tp99, мс\tв работе (пик)\tожиданий пула\tповторных соединений")
+    try:
+        for limit in args.limits:
+            for keepalive in (15, 0):
+                rate, p50, p99, peak, waits, reused = await run(limit, keepalive, args.requests, args.concurrency, args.port)
+                print(
+                    f"{limit}\t{'да' if keepalive else 'нет'}\t{rate:.0f}\t{p50:.1f}\t{p99:.1f}\t"
+                    f"{peak}\t{waits}\t{reused:.0%}"
+                )
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
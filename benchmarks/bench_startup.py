@@ -0,0 +1,50 @@
+#Замер холодного старта
+#python benchmarks/bench_startup.py --runs 5
+#
+#Каждый прогон - новый процесс интерпретатора: время импорта main.py по отчету
+#STARTUP, полное время процесса до конца импорта и загружен ли openpyxl.
+#Результат можно сравнивать между версиями бота
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys
+sys.path.insert(0, {root!r})
+import main
+print(json.dumps({{"import": main.STARTUP.phases["import"], "openpyxl": "openpyxl" in sys.modules}}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер холодного старта бота")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ, TELEGRAM_TOKEN="123456:" + "A" * 35)
+    imports, totals, openpyxl_loaded = [], [], False
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, "-c", CHILD.format(root=ROOT)],
+                env=env, cwd=tmp, capture_output=True, text=True, check=True
+            )
+            totals.append(time.perf_counter() - started)
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            imports.append(result["import"])
+            openpyxl_loaded |= result["openpyxl"]
+
+    print(f"импорт main.py: медиана {statistics.median(imports) * 1000:.0f} мс")
+    print(f"процесс целиком: медиана {statistics.median(totals) * 1000:.0f} мс")
+    print(f"openpyxl загружен при импорте: {'да' if openpyxl_loaded else 'нет'}")
+
+if __name__ == "__main__":
+    main()
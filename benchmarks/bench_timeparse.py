@@ -0,0 +1,81 @@
+#Замер проверки диапазона времени
+#python benchmarks/bench_timeparse.py --inputs 200000
+#
+#Сравнивает прежнюю проверку через два вызова datetime.strptime с разбором
+#скомпилированным регулярным выражением: без кеша и с кешем повторяющихся строк
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timeparse import parse_time_range
+
+def old_is_valid_time_range(time_str):
+    """Прежняя проверка из main.py"""
+    try:
+        if '-' not in time_str:
+            return False, "❌ Используйте формат ЧЧ:MM-ЧЧ:MM (например, 9:00-12:00)"
+
+        start_time_str, end_time_str = time_str.split('-')
+
+        start_time = datetime.strptime(start_time_str.strip(), '%H:%M')
+        end_time = datetime.strptime(end_time_str.strip(), '%H:%M')
+
+        if start_time >= end_time:
+            return False, "❌ Время начала должно быть раньше времени окончания"
+
+        return True, "Диапазон времени корректен"
+
+    except ValueError:
+        return False, "❌ Неверный формат времени. Используйте ЧЧ:MM-ЧЧ:MM (например, 9:00-12:00):"
+
+def new_is_valid_time_range(time_str, parse=parse_time_range):
+    interval = parse(time_str)
+    return interval is not None and interval[0] < interval[1]
+
+def uncached_is_valid_time_range(time_str):
+    # __wrapped__ - функция разбора без lru_cache
+    return new_is_valid_time_range(time_str, parse_time_range.__wrapped__)
+
+def make_inputs(count, unique):
+    """Диапазоны в формате ЧЧ:MM-ЧЧ:MM; unique - число различных строк"""
+    rng = random.Random(1)
+    pool = []
+    for _ in range(unique):
+        start = rng.randrange(8 * 60, 18 * 60, 15)
+        end = start + rng.randrange(30, 240, 15)
+        pool.append(f"{start // 60}:{start % 60:02d}-{end // 60}:{end % 60:02d}")
+    return [pool[rng.randrange(unique)] for _ in range(count)]
+
+def run(function, inputs):
+    started = time.perf_counter()
+    for text in inputs:
+        function(text)
+    return len(inputs) / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер проверки диапазона времени")
+    parser.add_argument("--inputs", type=int, default=200000)
+    parser.add_argument("--unique", type=int, default=500, help="число различных строк во входных данных")
+    args = parser.parse_args()
+
+    inputs = make_inputs(args.inputs, args.unique)
+    # Для формата ЧЧ:MM-ЧЧ:MM результаты должны совпадать
+    for text in set(inputs):
+        assert old_is_valid_time_range(text)[0] == new_is_valid_time_range(text)
+
+    old = run(old_is_valid_time_range, inputs)
+    uncached = run(uncached_is_valid_time_range, inputs)
+    parse_time_range.cache_clear()
+    cached = run(new_is_valid_time_range, inputs)
+    print(f"datetime.strptime: {old:.0f} проверок/сек")
+    print(f"регулярное выражение без кеша: {uncached:.0f} проверок/сек ({uncached / old:.1f}x)")
+    print(f"регулярное выражение с кешем: {cached:.0f} проверок/сек ({cached / old:.1f}x)")
+
+if __name__ == "__main__":
+    main()
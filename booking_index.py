@@ -0,0 +1,64 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BookingIndex:
+    """Индекс записей в памяти: по Телеграм ID, дню недели и статусу.
+
+    Строится один раз при запуске потоковым чтением хранилища и дополняется
+    каждой новой записью, поэтому команды не перечитывают файл.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.by_user = {}
+        self.by_day = {}
+        self.by_status = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def load(self, records):
+        """Заполняет индекс заново (вызывается в потоке записи)"""
+        self.records = {}
+        self.by_user = {}
+        self.by_day = {}
+        self.by_status = {}
+        self.add_many(records)
+        logger.info(f"Индекс записей построен: {len(self.records)}")
+
+    def add(self, record):
+        self.records[record.record_id] = record
+        self.by_user.setdefault(str(record.user_id), {})[record.record_id] = None
+        self.by_day.setdefault(record.day, {})[record.record_id] = None
+        self.by_status.setdefault(record.status, {})[record.record_id] = None
+
+    def add_many(self, records):
+        for record in records:
+            self.add(record)
+
+    def update_status(self, record_id, status):
+        """Меняет статус записи в индексе и возвращает обновленную запись"""
+        record = self.records.get(record_id)
+        if record is None:
+            return None
+        self.by_status.get(record.status, {}).pop(record_id, None)
+        record = record._replace(status=status)
+        self.records[record_id] = record
+        self.by_status.setdefault(status, {})[record_id] = None
+        return record
+
+    def for_user(self, user_id):
+        """Записи клиента в порядке создания"""
+        return [self.records[record_id] for record_id in self.by_user.get(str(user_id), ())]
+
+    def with_status(self, status, day=None):
+        """Записи с указанным статусом, при необходимости только за один день"""
+        ids = self.by_status.get(status, {})
+        if day is not None:
+            day_ids = self.by_day.get(day, {})
+            # Перебираем меньшее из двух множеств
+            if len(day_ids) < len(ids):
+                return [self.records[record_id] for record_id in day_ids if record_id in ids]
+            return [self.records[record_id] for record_id in ids if record_id in day_ids]
+        return [self.records[record_id] for record_id in ids]
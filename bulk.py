@@ -0,0 +1,138 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from storage import HEADERS
+
+logger = logging.getLogger(__name__)
+
+# Форматы массовой выгрузки и расширения файлов, по которым они определяются
+FORMATS = {
+    "csv": ".csv",
+    "csv.gz": ".csv.gz",
+    "columnar": ".bcol",
+    "xlsx": ".xlsx",
+}
+
+# Колоночный формат: заголовок, затем блоки по chunk_rows строк.
+# Блок - число строк и колонок, затем каждая колонка отдельно: длина и
+# сжатый zlib JSON-список значений. Значения одной колонки (дни, время,
+# статусы) сильно повторяются и сжимаются лучше, чем строки CSV
+COLUMNAR_MAGIC = b"BCOL1\n"
+CHUNK_HEADER = struct.Struct("<II")
+COLUMN_SIZE = struct.Struct("<I")
+
+def detect_format(file_path):
+    """Формат файла по расширению"""
+    for name, ext in sorted(FORMATS.items(), key=lambda item: -len(item[1])):
+        if file_path.endswith(ext):
+            return name
+    raise ValueError(f"Не удалось определить формат файла {file_path}, укажите --format")
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+def _encode_csv(rows, header, level, compress):
+    buffer = io.StringIO()
+    if header:
+        # BOM нужен Excel, чтобы открыть кириллицу без выбора кодировки
+        buffer.write("\ufeff")
+        csv.writer(buffer).writerow(HEADERS)
+    csv.writer(buffer).writerows(rows)
+    data = buffer.getvalue().encode("utf-8")
+    # Каждый блок - отдельный член gzip: склеенные члены читаются как один файл
+    return gzip.compress(data, compresslevel=level, mtime=0) if compress else data
+
+def _encode_columnar(rows, header, level, compress=True):
+    parts = [COLUMNAR_MAGIC] if header else []
+    columns = list(zip(*rows))
+    parts.append(CHUNK_HEADER.pack(len(rows), len(columns)))
+    for column in columns:
+        data = zlib.compress(json.dumps(column, ensure_ascii=False).encode("utf-8"), level)
+        parts.append(COLUMN_SIZE.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+def export_rows(rows, file_path, file_format, chunk_rows=50000, workers=4, level=6):
+    """Потоково выгружает записи в CSV, CSV.GZ или колоночный формат.
+
+    Строки читаются блоками по chunk_rows, блоки кодируются и сжимаются в
+    пуле потоков (zlib отпускает GIL), а пишутся в файл по порядку. В работе
+    одновременно не больше 2 * workers блоков, поэтому расход памяти не
+    зависит от числа записей.
+    """
+    encode = _encode_columnar if file_format == "columnar" else _encode_csv
+    # Сжатие определяется форматом, а не уровнем: csv.gz с уровнем 0 - это
+    # gzip без сжатия, который по-прежнему читается при загрузке
+    compress = file_format != "csv"
+
+    count = 0
+    started = time.perf_counter()
+    pending = deque()
+    with open(file_path, "wb") as file, ThreadPoolExecutor(max_workers=workers) as pool:
+        for number, chunk in enumerate(chunked(rows, chunk_rows)):
+            pending.append(pool.submit(encode, chunk, number == 0, level, compress))
+            count += len(chunk)
+            if len(pending) >= 2 * workers:
+                file.write(pending.popleft().result())
+        while pending:
+            file.write(pending.popleft().result())
+        if not count:
+            # Пустая выгрузка: только заголовок
+            file.write(COLUMNAR_MAGIC if file_format == "columnar" else encode([], True, level, compress))
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Выгружено {count} записей в {file_path} за {elapsed:.1f} сек ({count / max(elapsed, 1e-9):.0f} строк/сек)")
+    return count
+
+def _read_csv(file_path, compressed):
+    opener = gzip.open if compressed else open
+    with opener(file_path, "rt", encoding="utf-8-sig", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is not None and header != HEADERS:
+            raise ValueError(f"Неожиданные колонки в {file_path}: {header}")
+        for row in reader:
+            if len(row) != len(HEADERS):
+                raise ValueError(f"Строка {reader.line_num} в {file_path}: ожидалось {len(HEADERS)} колонок")
+            yield row
+
+def _read_columnar(file_path):
+    with open(file_path, "rb") as file:
+        if file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(f"Файл {file_path} не в колоночном формате")
+        while header := file.read(CHUNK_HEADER.size):
+            _, columns_count = CHUNK_HEADER.unpack(header)
+            if columns_count != len(HEADERS):
+                raise ValueError(f"Блок в {file_path}: ожидалось {len(HEADERS)} колонок")
+            columns = []
+            for _ in range(columns_count):
+                size, = COLUMN_SIZE.unpack(file.read(COLUMN_SIZE.size))
+                columns.append(json.loads(zlib.decompress(file.read(size))))
+            yield from zip(*columns)
+
+def read_rows(file_path, file_format):
+    """Потоково читает записи из файла выгрузки"""
+    if file_format == "columnar":
+        return _read_columnar(file_path)
+    return _read_csv(file_path, compressed=file_format == "csv.gz")
+
+def import_rows(db, rows, batch_size=50000):
+    """Добавляет записи в базу SQLite пачками, каждая пачка - отдельная транзакция"""
+    count = 0
+    started = time.perf_counter()
+    for batch in chunked(rows, batch_size):
+        count += db.insert_batch(batch)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Загружено {count} записей в {db.db_path} за {elapsed:.1f} сек ({count / max(elapsed, 1e-9):.0f} строк/сек)")
+    return count
@@ -0,0 +1,88 @@
+#Обслуживание хранилища записей
+#python cli.py migrate --excel appointments.xlsx --db appointments.db
+#python cli.py export --db appointments.db --output appointments.xlsx
+#python cli.py export --db appointments.db --output appointments.csv.gz --workers 4
+#python cli.py import --db appointments.db --input appointments.bcol
+
+import argparse
+import gzip
+import logging
+
+from bulk import FORMATS, detect_format, export_rows, import_rows, read_rows
+from storage import ExcelManager, SQLiteStorage, export_to_excel, migrate_excel_to_sqlite
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def cmd_migrate(args):
+    """Переносит записи из Excel в SQLite"""
+    migrate_excel_to_sqlite(args.excel, args.db)
+
+def cmd_export(args):
+    """Выгружает записи из SQLite (или Excel) в Excel, CSV или колоночный формат"""
+    file_format = args.format or detect_format(args.output)
+    source = ExcelManager(args.excel) if args.excel else SQLiteStorage(args.db)
+    try:
+        if file_format == "xlsx":
+            export_to_excel(source.iter_rows(), args.output)
+        else:
+            export_rows(
+                source.iter_rows(), args.output, file_format,
+                chunk_rows=args.chunk_rows, workers=args.workers, level=args.level
+            )
+    finally:
+        source.close()
+
+def cmd_import(args):
+    """Загружает записи из CSV или колоночного файла в SQLite"""
+    file_format = args.format or detect_format(args.input)
+    if file_format == "xlsx":
+        raise SystemExit("Для переноса из Excel используйте команду migrate")
+    db = SQLiteStorage(args.db)
+    try:
+        import_rows(db, read_rows(args.input, file_format), batch_size=args.batch_size)
+    finally:
+        db.close()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Обслуживание хранилища записей на прием")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate", help="перенести записи из appointments.xlsx в SQLite")
+    migrate.add_argument("--excel", default="appointments.xlsx", help="исходный файл Excel")
+    migrate.add_argument("--db", default="appointments.db", help="файл базы SQLite")
+    migrate.set_defaults(func=cmd_migrate)
+
+    export = commands.add_parser("export", help="выгрузить записи из SQLite в Excel, CSV или колоночный формат")
+    export.add_argument("--db", default="appointments.db", help="файл базы SQLite")
+    export.add_argument("--excel", help="выгрузить из файла Excel вместо базы SQLite")
+    export.add_argument("--output", default="appointments.xlsx", help="файл для выгрузки")
+    export.add_argument("--format", choices=FORMATS, help="формат файла (по умолчанию - по расширению)")
+    export.add_argument("--chunk-rows", type=int, default=50000, help="строк в одном блоке")
+    export.add_argument("--workers", type=int, default=4, help="потоков сжатия блоков")
+    export.add_argument("--level", type=int, default=6, help="уровень сжатия zlib (1-9)")
+    export.set_defaults(func=cmd_export)
+
+    load = commands.add_parser("import", help="загрузить записи из CSV или колоночного файла в SQLite")
+    load.add_argument("--db", default="appointments.db", help="файл базы SQLite")
+    load.add_argument("--input", required=True, help="файл выгрузки")
+    load.add_argument("--format", choices=FORMATS, help="формат файла (по умолчанию - по расширению)")
+    load.add_argument("--batch-size", type=int, default=50000, help="строк в одной транзакции")
+    load.set_defaults(func=cmd_import)
+
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    try:
+        args.func(args)
+    except (ValueError, gzip.BadGzipFile) as e:
+        # Неизвестный формат, файл с другими колонками или не в указанном формате
+        logger.error(e)
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+#Запуск бота в нескольких процессах
+#python cluster.py --workers 4
+#
+#Один процесс получает обновления (long polling или webhook, как задано в BOT_MODE)
+#и раздает их рабочим процессам по Телеграм ID пользователя, поэтому диалог
+#каждого пользователя целиком обрабатывает один процесс. Состояния FSM лежат в
+#общем файле, поэтому диалоги не теряются при изменении --workers. Хранилище
+#записей открывает только процесс записи: операции всех рабочих процессов
+#выполняются в нем по очереди. Очередь уведомлений и напоминания ведет один
+#процесс уведомлений, поэтому лимиты отправки действуют на весь бот
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+import aiohttp
+from aiogram.types import InlineKeyboardMarkup
+from aiohttp import web
+
+from fsm_storage import SQLiteFSMStorage
+from session import api_server
+from storage import BookingStorage
+
+logger = logging.getLogger(__name__)
+
+# Операции хранилища, после которых остальные процессы обновляют индексы записей
+CHANGING_CALLS = {"book_appointment", "book_multiple_appointments", "update_status"}
+
+def update_user_id(update):
+    """Телеграм ID отправителя обновления (для обновлений без отправителя - update_id)"""
+    for key in ("message", "edited_message", "callback_query"):
+        event = update.get(key)
+        if event and "from" in event:
+            return event["from"]["id"]
+    return update["update_id"]
+
+class RemoteStorage(BookingStorage):
+    """Хранилище рабочего процесса: операции передаются процессу записи.
+
+    Вызовы выполняются в потоке StorageWriteWorker рабочего процесса, поэтому
+    блокирующее ожидание ответа не задерживает цикл событий, а запросы одного
+    процесса идут строго по очереди.
+    """
+
+    def __init__(self, worker_index, requests, responses):
+        self.worker_index = worker_index
+        self.requests = requests
+        self.responses = responses
+
+    def _call(self, name, *args):
+        self.requests.put((self.worker_index, name, args))
+        ok, result = self.responses.get()
+        if not ok:
+            raise RuntimeError(f"Ошибка процесса записи: {result}")
+        return result
+
+    def book_appointment(self, days_str, time_range_str, username, user_id, phone, situation):
+        return self._call("book_appointment", days_str, time_range_str, username, user_id, phone, situation)
+
+    def book_multiple_appointments(self, selected_days, days_with_times, username, user_id, phone, situation):
+        return self._call(
+            "book_multiple_appointments", selected_days, days_with_times, username, user_id, phone, situation
+        )
+
+    def update_status(self, record_id, status, user_id=None, day=None):
+        return self._call("update_status", record_id, status, user_id, day)
+
+    def iter_records(self):
+        return iter(self._call("list_records"))
+
+class RemoteNotifier:
+    """Очередь уведомлений рабочего процесса: сообщения передаются процессу уведомлений"""
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    async def enqueue(self, chat_id, text, reply_markup=None, kind="client"):
+        markup_json = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+        self.outbox.put(("notify", chat_id, text, markup_json, kind))
+
+class RemoteReminders:
+    """Напоминания рабочего процесса: планирует и отменяет их процесс уведомлений"""
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    async def add(self, due_at, record_id, chat_id, text):
+        self.outbox.put(("remind", due_at, record_id, chat_id, text))
+
+    async def cancel(self, record_id):
+        self.outbox.put(("cancel", record_id))
+
+def run_writer(requests, responses, inboxes):
+    """Процесс записи: единственный процесс, который открывает хранилище"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from storage import ExcelManager, SQLiteStorage, create_booking_storage, export_to_excel
+
+    storage = create_booking_storage()
+    storage.load()
+    resident = isinstance(storage, ExcelManager) and storage.resident
+    flush_interval = float(os.getenv("EXCEL_FLUSH_INTERVAL", "5"))
+    export_interval = float(os.getenv("EXCEL_EXPORT_INTERVAL", "0")) if isinstance(storage, SQLiteStorage) else 0
+    flushed_at = exported_at = time.monotonic()
+
+    while True:
+        try:
+            request = requests.get(timeout=flush_interval)
+        except queue.Empty:
+            request = ()
+        if request is None:
+            break
+
+        if request:
+            worker_index, name, args = request
+            try:
+                if name == "list_records":
+                    result = list(storage.iter_records())
+                else:
+                    result = getattr(storage, name)(*args)
+            except Exception as e:
+                logger.error(f"Ошибка операции {name}: {e}")
+                responses[worker_index].put((False, repr(e)))
+                continue
+            responses[worker_index].put((True, result))
+
+            # Остальные процессы добавляют записи в свои индексы
+            if name in CHANGING_CALLS and result:
+                records = result if isinstance(result, list) else [result]
+                for index, inbox in enumerate(inboxes):
+                    if index != worker_index:
+                        inbox.put(("records", records))
+
+        now = time.monotonic()
+        if resident and storage.pending_rows and now - flushed_at >= flush_interval:
+            storage.flush()
+            flushed_at = now
+        if export_interval and now - exported_at >= export_interval:
+            try:
+                export_to_excel(storage.iter_rows(), os.getenv("EXCEL_FILE", "appointments.xlsx"))
+            except Exception as e:
+                logger.error(f"Ошибка при выгрузке Excel: {e}")
+            exported_at = now
+
+    storage.close()
+    logger.info("Процесс записи остановлен")
+
+def worker_files(path):
+    """Файлы, которые прежние версии создавали для каждого рабочего процесса отдельно"""
+    root, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(root)}.worker*{ext}"))
+
+def merge_worker_files(main):
+    """Переносит сообщения, напоминания и состояния FSM из файлов рабочих процессов в общие"""
+    targets = [(main.NOTIFY_DB_FILE, main.notifier), (main.REMINDER_DB_FILE, main.reminders)]
+    if isinstance(main.storage, SQLiteFSMStorage):
+        targets.append((main.FSM_DB_FILE, main.storage))
+    for path, target in targets:
+        for leftover in worker_files(path):
+            try:
+                count = target.merge(leftover)
+            except Exception as e:
+                logger.error(f"Ошибка при переносе {leftover}: {e}")
+                continue
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(leftover + suffix):
+                    os.remove(leftover + suffix)
+            logger.info(f"Перенесено из {leftover} в {path}: {count}")
+
+def run_notifier(outbox, status, setup=None):
+    """Процесс уведомлений: единственный владелец очереди уведомлений и напоминаний"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import main
+
+    if setup is not None:
+        setup(main)
+    merge_worker_files(main)
+    asyncio.run(_notifier_loop(main, outbox, status))
+
+async def _notifier_loop(main, outbox, status):
+    main.notifier.start()
+    main.reminders.start()
+    loop = asyncio.get_running_loop()
+    status.put(("ready", "notifier"))
+    running = True
+    while running:
+        messages = [await loop.run_in_executor(None, outbox.get)]
+        try:
+            while len(messages) < 1000:
+                messages.append(outbox.get_nowait())
+        except queue.Empty:
+            pass
+        # Сообщения одного рабочего процесса выполняются в порядке отправки:
+        # отмена напоминаний о записи всегда раньше новых напоминаний о ней
+        for message in messages:
+            if message is None:
+                running = False
+                break
+            kind, *args = message
+            if kind == "notify":
+                chat_id, text, markup_json, notify_kind = args
+                reply_markup = InlineKeyboardMarkup.model_validate_json(markup_json) if markup_json else None
+                await main.notifier.enqueue(chat_id, text, reply_markup=reply_markup, kind=notify_kind)
+            elif kind == "remind":
+                await main.reminders.add(*args)
+            elif kind == "cancel":
+                await main.reminders.cancel(*args)
+
+    await main.reminders.stop()
+    await main.notifier.stop()
+    await main.bot.session.close()
+
+def run_worker(index, inbox, requests, responses, outbox, status, setup=None):
+    """Рабочий процесс: обработчики main.py для своей доли пользователей"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Очередь уведомлений и напоминания ведет процесс уведомлений, свои базы не нужны
+    os.environ["NOTIFY_DB_FILE"] = os.environ["REMINDER_DB_FILE"] = ":memory:"
+
+    import main
+
+    main.booking_storage = RemoteStorage(index, requests, responses)
+    main.notifier = RemoteNotifier(outbox)
+    main.reminders = RemoteReminders(outbox)
+    if setup is not None:
+        setup(main)
+    asyncio.run(_worker_loop(main, index, inbox, status))
+
+async def _worker_loop(main, index, inbox, status):
+    bot, dp = main.bot, main.dp
+    main.booking_writer.start()
+    await main.prepare_storage()
+    await dp.emit_startup(bot=bot)
+
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    handled = 0
+
+    async def handle(update):
+        nonlocal handled
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления {update.get('update_id')}: {e}")
+        handled += 1
+
+    status.put(("ready", index))
+    running = True
+    while running:
+        messages = [await loop.run_in_executor(None, inbox.get)]
+        # Забираем все накопившиеся сообщения без лишних переходов в поток
+        try:
+            while len(messages) < 1000:
+                messages.append(inbox.get_nowait())
+        except queue.Empty:
+            pass
+        for message in messages:
+            if message is None:
+                running = False
+                break
+            kind, payload = message
+            if kind == "records":
+                main.index_bookings(payload)
+            else:
+                task = asyncio.create_task(handle(payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks)
+    await dp.emit_shutdown(bot=bot)
+    await main.booking_writer.stop()
+    await bot.session.close()
+    status.put(("stopped", index, handled))
+
+class Cluster:
+    """Процесс записи, процесс уведомлений и рабочие процессы с очередями между ними"""
+
+    def __init__(self, workers, setup=None):
+        self.context = multiprocessing.get_context("spawn")
+        self.inboxes = [self.context.Queue() for _ in range(workers)]
+        self.requests = self.context.Queue()
+        self.responses = [self.context.Queue() for _ in range(workers)]
+        self.outbox = self.context.Queue()
+        self.status = self.context.Queue()
+        self.writer = self.context.Process(
+            target=run_writer, args=(self.requests, self.responses, self.inboxes), name="storage-writer"
+        )
+        self.notifier = self.context.Process(target=run_notifier, args=(self.outbox, self.status, setup), name="notifier")
+        self.workers = [
+            self.context.Process(
+                target=run_worker,
+                args=(
+                    index, self.inboxes[index], self.requests, self.responses[index], self.outbox, self.status, setup
+                ),
+                name=f"worker-{index}"
+            )
+            for index in range(workers)
+        ]
+
+    def start(self):
+        """Запускает процессы и ждет готовности рабочих"""
+        self.writer.start()
+        self.notifier.start()
+        # Рабочие процессы открывают общий файл FSM только после переноса старых файлов
+        self.status.get()
+        for process in self.workers:
+            process.start()
+        for _ in self.workers:
+            self.status.get()
+        logger.info(f"Рабочих процессов запущено: {len(self.workers)}")
+
+    def route(self, update):
+        """Передает обновление процессу, который ведет этого пользователя"""
+        self.inboxes[update_user_id(update) % len(self.inboxes)].put(("update", update))
+
+    def stop(self):
+        """Дожидается обработки переданных обновлений и останавливает процессы"""
+        for inbox in self.inboxes:
+            inbox.put(None)
+        handled = {}
+        for _ in self.workers:
+            _, index, count = self.status.get()
+            handled[index] = count
+        for process in self.workers:
+            process.join()
+        # Все сообщения рабочих процессов уже в очереди, None придет после них
+        self.outbox.put(None)
+        self.notifier.join()
+        self.requests.put(None)
+        self.writer.join()
+        logger.info(f"Обработано обновлений по процессам: {handled}")
+        return handled
+
+async def poll_updates(cluster, token):
+    """Long polling: обновления передаются рабочим процессам без разбора в объекты aiogram"""
+    api = api_server(os.getenv("BOT_API_URL"), os.getenv("BOT_API_LOCAL", "0") == "1")
+    async with aiohttp.ClientSession() as session:
+        await session.post(api.api_url(token, "deleteWebhook"))
+        url = api.api_url(token, "getUpdates")
+        offset = None
+        while True:
+            params = {"timeout": 30, "allowed_updates": json.dumps(["message", "callback_query"])}
+            if offset is not None:
+                params["offset"] = offset
+            try:
+                async with session.post(url, data=params, timeout=aiohttp.ClientTimeout(total=40)) as response:
+                    result = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not result.get("ok"):
+                logger.error(f"Ошибка получения обновлений: {result.get('description')}")
+                await asyncio.sleep(result.get("parameters", {}).get("retry_after", 1))
+                continue
+            for update in result["result"]:
+                cluster.route(update)
+                offset = update["update_id"] + 1
+
+async def serve_webhook(cluster, token, stop_event):
+    """Webhook: проверяет секрет и передает обновление рабочему процессу"""
+    webhook_url = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")
+    if not webhook_url:
+        raise RuntimeError("Для режима webhook задайте WEBHOOK_URL")
+    webhook_path = os.getenv("WEBHOOK_PATH", "/webhook")
+    secret = os.getenv("WEBHOOK_SECRET") or os.urandom(24).hex()
+
+    async def webhook(request):
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=401)
+        cluster.route(await request.json())
+        return web.Response()
+
+    async def health(request):
+        return web.json_response({"status": "ok", "workers": len(cluster.workers)})
+
+    app = web.Application()
+    app.router.add_post(webhook_path, webhook)
+    app.router.add_get("/health", health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=os.getenv("WEB_SERVER_HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8080")))
+    await site.start()
+
+    api = api_server(os.getenv("BOT_API_URL"), os.getenv("BOT_API_LOCAL", "0") == "1")
+    async with aiohttp.ClientSession() as session:
+        await session.post(api.api_url(token, "setWebhook"), data={
+            "url": f"{webhook_url}{webhook_path}",
+            "secret_token": secret,
+            "allowed_updates": json.dumps(["message", "callback_query"]),
+        })
+    logger.info(f"Webhook установлен: {webhook_url}{webhook_path}")
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+
+async def receive(cluster, token, mode):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    if mode == "webhook":
+        await serve_webhook(cluster, token, stop_event)
+        return
+    polling = asyncio.create_task(poll_updates(cluster, token))
+    await stop_event.wait()
+    polling.cancel()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Запуск бота в нескольких процессах")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", os.cpu_count() or 1)))
+    args = parser.parse_args()
+
+    token = os.getenv("TELEGRAM_TOKEN")
+    cluster = Cluster(args.workers)
+    cluster.start()
+    try:
+        asyncio.run(receive(cluster, token, os.getenv("BOT_MODE", "polling")))
+    finally:
+        logger.info("Остановка рабочих процессов...")
+        cluster.stop()
+
+if __name__ == "__main__":
+    main()
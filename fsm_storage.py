@@ -0,0 +1,163 @@
+import asyncio
+import copy
+import json
+import logging
+import sqlite3
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+logger = logging.getLogger(__name__)
+
+class SQLiteFSMStorage(BaseStorage):
+    """Хранилище состояний FSM в локальном файле SQLite.
+
+    Состояния и данные диалогов держатся в памяти, изменения сбрасываются
+    в базу пакетом раз в flush_interval секунд и при остановке бота.
+    Записи, к которым не обращались cache_ttl секунд, выгружаются из памяти,
+    а брошенные более state_ttl секунд назад диалоги удаляются из базы.
+    """
+
+    def __init__(self, db_path, flush_interval=1.0, cache_ttl=600, state_ttl=7 * 24 * 3600):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.state_ttl = state_ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # ключ -> [состояние, данные, время последнего обращения]
+        self.cache = {}
+        self.dirty = set()
+        self.flush_task = None
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, "
+                "state TEXT, "
+                "data TEXT NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm (updated_at)")
+
+    def merge(self, db_path):
+        """Переносит состояния из другой базы FSM, при совпадении ключа остается более новое"""
+        other = sqlite3.connect(db_path)
+        rows = other.execute("SELECT key, state, data, updated_at FROM fsm").fetchall()
+        other.close()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated_at = excluded.updated_at WHERE excluded.updated_at > fsm.updated_at",
+                rows
+            )
+        return len(rows)
+
+    def _entry(self, key):
+        """Возвращает запись из памяти, при необходимости загружая ее из базы"""
+        key_str = self.key_builder.build(key)
+        entry = self.cache.get(key_str)
+        if entry is None:
+            row = self.conn.execute("SELECT state, data FROM fsm WHERE key = ?", (key_str,)).fetchone()
+            if row:
+                entry = [row[0], json.loads(row[1]), 0.0]
+            else:
+                entry = [None, {}, 0.0]
+            self.cache[key_str] = entry
+        entry[2] = time.monotonic()
+        return key_str, entry
+
+    def _mark_dirty(self, key_str):
+        self.dirty.add(key_str)
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def set_state(self, key, state=None):
+        key_str, entry = self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key_str)
+
+    async def get_state(self, key):
+        return self._entry(key)[1][0]
+
+    async def set_data(self, key, data):
+        key_str, entry = self._entry(key)
+        entry[1] = copy.deepcopy(data)
+        self._mark_dirty(key_str)
+
+    async def get_data(self, key):
+        return copy.deepcopy(self._entry(key)[1][1])
+
+    async def get_record(self, key):
+        """Возвращает состояние и данные за одно обращение"""
+        _, entry = self._entry(key)
+        return entry[0], copy.deepcopy(entry[1])
+
+    async def set_record(self, key, state, data):
+        """Записывает состояние и данные за одно обращение"""
+        key_str, entry = self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        entry[1] = copy.deepcopy(data)
+        self._mark_dirty(key_str)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                self._evict()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении состояний FSM: {e}")
+
+    async def flush(self):
+        """Записывает все измененные состояния одной транзакцией"""
+        if not self.dirty:
+            return
+        now = time.time()
+        upserts = []
+        deletes = []
+        for key_str in self.dirty:
+            state, data, _ = self.cache[key_str]
+            if state is None and not data:
+                deletes.append((key_str,))
+            else:
+                upserts.append((key_str, state, json.dumps(data, ensure_ascii=False), now))
+        flushed = set(self.dirty)
+        self.dirty.clear()
+        try:
+            await asyncio.to_thread(self._write, upserts, deletes)
+        except Exception:
+            # Повторим запись при следующем сбросе
+            self.dirty.update(flushed)
+            raise
+
+    def _write(self, upserts, deletes):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)", upserts)
+            self.conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+        logger.debug(f"Состояния FSM сохранены: {len(upserts)} обновлено, {len(deletes)} удалено")
+
+    def _evict(self):
+        """Выгружает из памяти давно неактивные диалоги и удаляет брошенные из базы"""
+        deadline = time.monotonic() - self.cache_ttl
+        expired = [
+            key_str for key_str, entry in self.cache.items()
+            if entry[2] < deadline and key_str not in self.dirty
+        ]
+        for key_str in expired:
+            del self.cache[key_str]
+        if expired:
+            with self.conn:
+                self.conn.execute("DELETE FROM fsm WHERE updated_at < ?", (time.time() - self.state_ttl,))
+            logger.info(f"Из памяти выгружено неактивных диалогов: {len(expired)}")
+
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+        self.conn.close()
+        logger.info("Хранилище состояний FSM закрыто")
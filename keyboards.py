@@ -0,0 +1,94 @@
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+from schedule import WEEKDAYS
+
+# Клавиатуры создаются один раз при импорте. Объекты aiogram неизменяемы,
+# поэтому один и тот же экземпляр можно отправлять во всех ответах
+
+MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="📅 Записаться на прием")],
+        [KeyboardButton(text="🆘 Помощь")]
+    ],
+    resize_keyboard=True,
+    input_field_placeholder="Выберите действие..."
+)
+
+# Клавиатура с кнопкой возврата в главное меню (используется и при вводе времени)
+BACK_TO_MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="↩️ В главное меню")]],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
+
+# Выбор дней под одним сообщением: нажатие меняет отметку ✅ и редактирует клавиатуру
+class DayPick(CallbackData, prefix="day"):
+    action: str  # toggle, done или menu
+    day: int = 0  # номер дня в WEEKDAYS
+
+def _day_button(index, mask):
+    mark = "✅ " if mask & (1 << index) else ""
+    return InlineKeyboardButton(
+        text=f"{mark}{WEEKDAYS[index]}", callback_data=DayPick(action="toggle", day=index).pack()
+    )
+
+def _build_days_picker(mask):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [_day_button(0, mask), _day_button(1, mask)],
+        [_day_button(2, mask), _day_button(3, mask)],
+        [_day_button(4, mask), _day_button(5, mask)],
+        [_day_button(6, mask)],
+        [InlineKeyboardButton(text="✅ Завершить выбор дней", callback_data=DayPick(action="done").pack())],
+        [InlineKeyboardButton(text="↩️ В главное меню", callback_data=DayPick(action="menu").pack())]
+    ])
+
+# Все 128 вариантов отметок создаются заранее (индекс - битовая маска выбранных дней)
+DAYS_PICKER_KEYBOARDS = tuple(_build_days_picker(mask) for mask in range(1 << len(WEEKDAYS)))
+
+# Статические клавиатуры, JSON которых сессия бота может сериализовать один раз
+STATIC_KEYBOARDS = (MAIN_KEYBOARD, BACK_TO_MAIN_KEYBOARD) + DAYS_PICKER_KEYBOARDS
+
+# Клавиатуры
+def get_main_keyboard():
+    return MAIN_KEYBOARD
+
+def get_back_to_main_keyboard():
+    """Клавиатура с кнопкой возврата в главное меню"""
+    return BACK_TO_MAIN_KEYBOARD
+
+def get_days_picker_keyboard(selected_days):
+    """Inline-клавиатура выбора дней с отметками у выбранных"""
+    mask = 0
+    for day in selected_days:
+        mask |= 1 << WEEKDAYS.index(day)
+    return DAYS_PICKER_KEYBOARDS[mask]
+
+def get_time_input_keyboard():
+    """Клавиатура для ввода времени с кнопкой возврата в главное меню"""
+    return BACK_TO_MAIN_KEYBOARD
+
+# Действия администратора с заявкой: confirm, decline, reschedule.
+# Кроме номера строки (id записи) кнопка несет Телеграм ID клиента и номер дня
+# недели (-1 - не один день): строки могут сдвинуться после ручной правки
+# таблицы или переноса в SQLite, и тогда кнопка не должна менять чужую запись
+class BookingAction(CallbackData, prefix="booking"):
+    action: str
+    record_id: int
+    user_id: str
+    day: int
+
+def _booking_action(action, record):
+    day = WEEKDAYS.index(record.day) if record.day in WEEKDAYS else -1
+    return BookingAction(action=action, record_id=record.record_id, user_id=record.user_id, day=day).pack()
+
+def get_booking_actions_keyboard(records):
+    """Кнопки подтверждения, отклонения и переноса для каждой записи заявки"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=f"✅ {record.day}", callback_data=_booking_action("confirm", record)),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=_booking_action("decline", record)),
+            InlineKeyboardButton(text="🔁 Перенос", callback_data=_booking_action("reschedule", record)),
+        ]
+        for record in records
+    ])
@@ -9,21 +9,44 @@
 #Установка зависимостей
 #pip install -r requirements.txt
 
+import time
+# Начало импорта - точка отсчета для отчета о времени запуска
+IMPORT_STARTED = time.perf_counter()
+
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-import openpyxl
-from openpyxl.styles import PatternFill
-from openpyxl import load_workbook
-from openpyxl.styles import NamedStyle
+from aiogram.types import InlineKeyboardMarkup
+import hashlib
+import json
 import os
+import secrets
+import signal
 from datetime import datetime, timedelta
-from openpyxl.styles import Alignment
+from zoneinfo import ZoneInfo
+from aiohttp import web
+from aiogram.fsm.storage.memory import SimpleEventIsolation
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from booking_index import BookingIndex
+from fsm_storage import SQLiteFSMStorage
+from keyboards import (
+    STATIC_KEYBOARDS, BookingAction, DayPick, get_back_to_main_keyboard, get_booking_actions_keyboard,
+    get_days_picker_keyboard, get_main_keyboard, get_time_input_keyboard
+)
+from reminders import ReminderScheduler
+from schedule import WEEKDAYS, SlotIndex, next_occurrence
+from metrics import DUPLICATE_BOOKINGS, STARTUP, metrics_handler, monitor_event_loop_lag, setup_metrics
+from middlewares import TTLCache, setup_buffered_fsm, setup_deduplication, setup_throttling
+from notifications import NotificationScheduler
+from session import BotSession, api_server, parse_method_timeouts
+from timeparse import format_time_range, parse_time_range
+from storage import (
+    STATUS_CONFIRMED, STATUS_DECLINED, STATUS_PENDING, STATUS_RESCHEDULE, ExcelManager, SQLiteStorage, StorageWriteWorker, create_booking_storage, export_to_excel
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -32,49 +55,101 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Отчет о запуске: import, ready (бот принимает обновления), storage_ready, first_update.
+# Этапы пишутся в лог, в /health и в метрику bot_startup_seconds
+STARTUP.started = IMPORT_STARTED
+STARTUP.mark("import")
+
 # Токен бота
 BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
+# Хранилище состояний FSM: FSM_STORAGE=memory (по умолчанию) или sqlite.
+# SQLite сохраняет незавершенные записи между перезапусками бота
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_DB_FILE = os.getenv("FSM_DB_FILE", "fsm.db")
+
+# Сессия Bot API. BOT_API_URL - адрес своего сервера Bot API (например,
+# http://localhost:8081 для локального telegram-bot-api), BOT_API_LOCAL=1 -
+# сервер запущен в режиме --local. Размер пула подбирается по метрикам
+# bot_api_requests_in_flight и bot_api_pool_wait_seconds в часы пик
+BOT_API_URL = os.getenv("BOT_API_URL")
+BOT_API_LOCAL = os.getenv("BOT_API_LOCAL", "0") == "1"
+BOT_API_POOL_LIMIT = int(os.getenv("BOT_API_POOL_LIMIT", "100"))
+BOT_API_POOL_PER_HOST = int(os.getenv("BOT_API_POOL_PER_HOST", "0"))
+BOT_API_KEEPALIVE = float(os.getenv("BOT_API_KEEPALIVE", "15"))
+BOT_API_DNS_TTL = int(os.getenv("BOT_API_DNS_TTL", "3600"))
+BOT_API_TIMEOUT = float(os.getenv("BOT_API_TIMEOUT", "60"))
+# Таймауты отдельных методов, например "sendMessage=10,answerCallbackQuery=5"
+BOT_API_METHOD_TIMEOUTS = parse_method_timeouts(os.getenv("BOT_API_METHOD_TIMEOUTS", ""))
+
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
-# Путь к файлу Excel
-EXCEL_FILE = "appointments.xlsx"
-
-# Создаем файл Excel если его нет
-def init_excel_file():
-    if not os.path.exists(EXCEL_FILE):
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Записи"
-        
-        # Заголовки (измененные)
-        headers = ["Дни недели", "Время", "Имя пользователя", "Телеграм ID", "Телефон", "Ситуация", "Статус"]
-        for col, header in enumerate(headers, 1):
-            ws.cell(row=1, column=col, value=header)
-        
-        # Устанавливаем ширину колонок
-        column_widths = [20, 20, 20, 15, 15, 30, 15]
-        for col, width in enumerate(column_widths, 1):
-            col_letter = openpyxl.utils.get_column_letter(col)
-            ws.column_dimensions[col_letter].width = width
-        
-        # Создаем стили для ячеек
-        text_style = NamedStyle(name="text_style", number_format='@')  # Текстовый формат
-        
-        # Добавляем стили в книгу
-        if 'text_style' not in wb.named_styles:
-            wb.add_named_style(text_style)
-        
-        # Устанавливаем форматы для столбцов
-        for row in range(2, 100):  # Устанавливаем для большего количества строк
-            for col in range(1, 8):  # Все колонки текстовые
-                ws.cell(row=row, column=col).style = 'text_style'
-        
-        wb.save(EXCEL_FILE)
-        logger.info("Excel файл создан с правильными форматами ячеек")
+bot = Bot(token=BOT_TOKEN, session=BotSession(
+    static_markups=STATIC_KEYBOARDS,
+    api=api_server(BOT_API_URL, BOT_API_LOCAL),
+    limit=BOT_API_POOL_LIMIT,
+    limit_per_host=BOT_API_POOL_PER_HOST,
+    keepalive_timeout=BOT_API_KEEPALIVE,
+    dns_cache_ttl=BOT_API_DNS_TTL,
+    timeout=BOT_API_TIMEOUT,
+    method_timeouts=BOT_API_METHOD_TIMEOUTS,
+))
+if FSM_STORAGE == "sqlite":
+    storage = SQLiteFSMStorage(FSM_DB_FILE)
+else:
+    storage = MemoryStorage()
+# Обновления обрабатываются параллельно, поэтому обновления одного пользователя
+# выполняются по очереди, чтобы не перезаписывать состояние друг друга
+dp = Dispatcher(storage=storage, events_isolation=SimpleEventIsolation())
+# Повторные обновления отсекаются до чтения состояния, поэтому дедупликация
+# подключается раньше, чем FSM-middleware переносится в конец цепочки
+setup_deduplication(dp)
+# Ограничение частоты: не больше THROTTLE_LIMIT обновлений от пользователя за
+# THROTTLE_WINDOW секунд (THROTTLE_LIMIT=0 - без ограничения), администратор не ограничивается
+THROTTLE_LIMIT = int(os.getenv("THROTTLE_LIMIT", "20"))
+THROTTLE_WINDOW = float(os.getenv("THROTTLE_WINDOW", "10"))
+if THROTTLE_LIMIT > 0:
+    setup_throttling(
+        dp, limit=THROTTLE_LIMIT, window=THROTTLE_WINDOW,
+        max_users=int(os.getenv("THROTTLE_MAX_USERS", "10000")),
+        exempt_ids=[os.getenv("ADMIN_ID")] if os.getenv("ADMIN_ID") else ()
+    )
+# Состояние читается один раз за обновление и записывается одной операцией
+setup_buffered_fsm(dp)
+# Метрики обработчиков и запросов к Bot API (страница /metrics)
+setup_metrics(dp, bot)
+
+# Режим получения обновлений: BOT_MODE=polling (по умолчанию) или webhook.
+# Для webhook нужен публичный адрес WEBHOOK_URL (на Render подставляется RENDER_EXTERNAL_URL),
+# сервер слушает порт PORT. Если WEBHOOK_SECRET не задан, он генерируется при запуске
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEB_SERVER_HOST = os.getenv("WEB_SERVER_HOST", "0.0.0.0")
+WEB_SERVER_PORT = int(os.getenv("PORT", "8080"))
+
+# Очередь уведомлений администратору: сохраняется в NOTIFY_DB_FILE и переживает перезапуск.
+# NOTIFY_DIGEST_WINDOW > 0 объединяет заявки, пришедшие за это число секунд, в одно сообщение.
+# NOTIFY_RATE - сообщений в секунду на весь бот (лимит Telegram около 30)
+ADMIN_ID = os.getenv("ADMIN_ID")
+NOTIFY_DB_FILE = os.getenv("NOTIFY_DB_FILE", "notifications.db")
+NOTIFY_DIGEST_WINDOW = float(os.getenv("NOTIFY_DIGEST_WINDOW", "0"))
+NOTIFY_MAX_QUEUE = int(os.getenv("NOTIFY_MAX_QUEUE", "1000"))
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", "25"))
+
+# Напоминания о подтвержденных записях за REMINDER_HOURS часов до начала (через запятую),
+# время записей считается в часовом поясе BOT_TIMEZONE
+REMINDER_DB_FILE = os.getenv("REMINDER_DB_FILE", "reminders.db")
+REMINDER_HOURS = [float(hours) for hours in os.getenv("REMINDER_HOURS", "24,2").split(",") if hours.strip()]
+BOT_TIMEZONE = ZoneInfo(os.getenv("BOT_TIMEZONE", "Europe/Moscow"))
+
+# Хранилище записей: STORAGE_BACKEND=excel (по умолчанию) или sqlite.
+# Для Excel режим EXCEL_RESIDENT=1 держит книгу в памяти и сохраняет ее раз в
+# EXCEL_FLUSH_INTERVAL секунд или после EXCEL_FLUSH_ROWS новых строк.
+# Для SQLite файл EXCEL_FILE выгружается из базы раз в EXCEL_EXPORT_INTERVAL секунд (0 - отключено)
+EXCEL_FILE = os.getenv("EXCEL_FILE", "appointments.xlsx")
+EXCEL_FLUSH_INTERVAL = float(os.getenv("EXCEL_FLUSH_INTERVAL", "5"))
+EXCEL_EXPORT_INTERVAL = float(os.getenv("EXCEL_EXPORT_INTERVAL", "0"))
 
 # Состояния FSM
 class AppointmentState(StatesGroup):
@@ -84,163 +159,179 @@ class AppointmentState(StatesGroup):
     choosing_days = State()
     entering_time_for_days = State()
 
-# Класс для работы с Excel
-class ExcelManager:
-    def __init__(self, file_path):
-        self.file_path = file_path
-        self.red_fill = PatternFill(start_color="FFB6C1", end_color="FFB6C1", fill_type="solid")
-    
-    def get_next_empty_row(self, ws):
-        """Находит следующую пустую строку в таблице"""
-        row = 2  # Начинаем с 2 строки (после заголовков)
-        while ws.cell(row=row, column=1).value is not None:
-            row += 1
-        return row
-    
-    def book_appointment(self, days_str, time_range_str, username, user_id, phone, situation):
-        """Записываем данные с днями недели и диапазоном времени"""
-        try:
-            wb = load_workbook(self.file_path)
-            ws = wb.active
-            
-            # Находим первую свободную строку
-            new_row = self.get_next_empty_row(ws)
-            
-            # Записываем данные (измененные колонки)
-            ws.cell(row=new_row, column=1, value=str(days_str))      # Дни недели
-            ws.cell(row=new_row, column=2, value=str(time_range_str)) # Диапазон времени
-            ws.cell(row=new_row, column=3, value=str(username))      # Имя
-            ws.cell(row=new_row, column=4, value=str(user_id))       # Телеграм ID
-            ws.cell(row=new_row, column=5, value=str(phone))         # Телефон
-            ws.cell(row=new_row, column=6, value=str(situation))     # Ситуация
-            ws.cell(row=new_row, column=7, value="Ожидает подтверждения")  # Статус
-            
-            # Красим строку для визуального выделения
-            for col in range(1, 8):
-                ws.cell(row=new_row, column=col).fill = self.red_fill
-            
-            wb.save(self.file_path)
-            wb.close()
-            logger.info(f"Запись сохранена в строке {new_row}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Ошибка при записи в Excel: {e}")
-            return False
-    
-    def book_multiple_appointments(self, selected_days, days_with_times, username, user_id, phone, situation):
-        """Создает отдельные записи для каждой пары день-время"""
+# Инициализация хранилища записей
+booking_storage = create_booking_storage()
+booking_writer = StorageWriteWorker()
+# Индекс записей по Телеграм ID, дню и статусу для /my_bookings и /pending
+booking_index = BookingIndex()
+
+# Занятое время по дням недели для подсказки свободных промежутков
+slot_index = SlotIndex()
+
+def build_booking_index():
+    """Строит новые индексы потоковым чтением хранилища (в потоке записи).
+
+    Обработчики в это время читают прежние индексы, новые подставляются в
+    цикле событий только целиком построенными.
+    """
+    bookings = BookingIndex()
+    bookings.load(booking_storage.iter_records())
+    slots = SlotIndex()
+    slots.load(bookings.records.values())
+    return bookings, slots
+
+# Устанавливается, когда подготовка хранилища завершена: хранилище открыто и
+# индексы построены или произошла ошибка (тогда storage_failed = True)
+storage_ready = asyncio.Event()
+storage_failed = False
+# Записи, добавленные в индексы, пока строились новые: после замены применяются к ним
+records_during_load = []
+# Сколько команды ждут построения индексов, прежде чем попросить повторить позже
+STORAGE_WAIT_TIMEOUT = float(os.getenv("STORAGE_WAIT_TIMEOUT", "10"))
+
+async def prepare_storage():
+    """Открывает хранилище и строит индексы уже после запуска бота.
+
+    Создание и оформление файла Excel не задерживает первые ответы, а
+    записи, пришедшие раньше, ждут в очереди потока записи.
+    """
+    global storage_failed, booking_index, slot_index
+    try:
+        await booking_writer.submit(booking_storage.load)
+        booking_index, slot_index = await booking_writer.submit(build_booking_index)
+    except Exception as e:
+        storage_failed = True
+        logger.error(f"Ошибка при открытии хранилища записей: {e}")
+    else:
+        storage_ready.set()
+        # Записи, измененные во время построения, могли не попасть в новые индексы
+        index_bookings(records_during_load)
+        records_during_load.clear()
+        STARTUP.mark("storage_ready")
+    # Ожидающие команды не должны зависнуть и при ошибке
+    storage_ready.set()
+
+async def wait_storage_ready():
+    """Ждет построения индексов; False, если хранилище недоступно или не успело открыться"""
+    try:
+        await asyncio.wait_for(storage_ready.wait(), STORAGE_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return False
+    return not storage_failed
+
+def index_bookings(records):
+    """Добавляет новые или измененные записи в индексы (повторный вызов ничего не меняет)"""
+    if not storage_ready.is_set():
+        records_during_load.extend(records)
+    for record in records:
+        if booking_index.update_status(record.record_id, record.status) is None:
+            booking_index.add(record)
+        slot_index.remove(record.record_id)
+        slot_index.add(record)
+
+def free_time_text(day):
+    """Подсказка со свободным временем на выбранный день"""
+    if not storage_ready.is_set() or storage_failed:
+        # Пока индексы не построены, подсказка была бы неверной
+        return ""
+    slots = slot_index.free_slots(day)
+    if not slots:
+        return "🕒 Свободного времени на этот день нет, психолог предложит ближайшее возможное\n\n"
+    return f"🕒 Свободное время: {', '.join(format_time_range(slot) for slot in slots)}\n\n"
+
+async def flush_storage_periodically():
+    """Периодически сохраняет накопленные в памяти строки Excel"""
+    while True:
+        await asyncio.sleep(EXCEL_FLUSH_INTERVAL)
+        if booking_storage.pending_rows:
+            await booking_writer.submit(booking_storage.flush)
+
+def export_bookings_to_excel():
+    """Выгружает записи из хранилища в файл Excel"""
+    return export_to_excel(booking_storage.iter_rows(), EXCEL_FILE)
+
+async def export_excel_periodically():
+    """Периодически обновляет выгрузку Excel из базы данных"""
+    while True:
+        await asyncio.sleep(EXCEL_EXPORT_INTERVAL)
         try:
-            wb = load_workbook(self.file_path)
-            ws = wb.active
-            
-            success_count = 0
-            
-            # Для каждого дня создаем отдельную запись
-            for day in selected_days:
-                time_range = days_with_times.get(day, "")
-                if time_range:
-                    # Находим первую свободную строку для каждой записи
-                    new_row = self.get_next_empty_row(ws)
-                    
-                    # Записываем данные для каждого дня отдельно
-                    ws.cell(row=new_row, column=1, value=str(day))          # День недели
-                    ws.cell(row=new_row, column=2, value=str(time_range))   # Диапазон времени
-                    ws.cell(row=new_row, column=3, value=str(username))     # Имя
-                    ws.cell(row=new_row, column=4, value=str(user_id))      # Телеграм ID
-                    ws.cell(row=new_row, column=5, value=str(phone))        # Телефон
-                    ws.cell(row=new_row, column=6, value=str(situation))    # Ситуация
-                    ws.cell(row=new_row, column=7, value="Ожидает подтверждения")  # Статус
-                    
-                    # Красим строку для визуального выделения
-                    for col in range(1, 8):
-                        ws.cell(row=new_row, column=col).fill = self.red_fill
-                    
-                    success_count += 1
-                    logger.info(f"Запись для дня {day} сохранена в строке {new_row}")
-            
-            wb.save(self.file_path)
-            wb.close()
-            logger.info(f"Создано {success_count} записей в Excel")
-            return success_count > 0
-            
+            await booking_writer.submit(export_bookings_to_excel)
         except Exception as e:
-            logger.error(f"Ошибка при записи в Excel: {e}")
-            return False
-
-# Инициализация менеджера Excel
-excel_manager = ExcelManager(EXCEL_FILE)
-
-# Клавиатуры
-def get_main_keyboard():
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📅 Записаться на прием")],
-            [KeyboardButton(text="🆘 Помощь")]
-        ],
-        resize_keyboard=True,
-        input_field_placeholder="Выберите действие..."
-    )
-    return keyboard
-
-def get_back_to_main_keyboard():
-    """Клавиатура с кнопкой возврата в главное меню"""
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="↩️ В главное меню")]],
-        resize_keyboard=True,
-        one_time_keyboard=True
+            logger.error(f"Ошибка при выгрузке Excel: {e}")
+
+# Ключи недавно принятых заявок: повторная отправка той же заявки не пишется в хранилище.
+# Ключ живет только в пределах окна повтора (двойное нажатие, повтор после сбоя
+# сети), чтобы клиент мог снова отправить ту же заявку после решения администратора
+BOOKING_DEDUP_TTL = float(os.getenv("BOOKING_DEDUP_TTL", "60"))
+recent_bookings = TTLCache(maxsize=10000, ttl=BOOKING_DEDUP_TTL)
+
+def booking_idempotency_key(user_id, selected_days, days_with_times, phone):
+    """Хеш содержимого заявки: пользователь, дни со временем и телефон"""
+    payload = json.dumps(
+        [user_id, [[day, days_with_times.get(day, "")] for day in selected_days], phone],
+        ensure_ascii=False
     )
+    return hashlib.sha256(payload.encode()).hexdigest()
 
-def get_days_keyboard():
-    """Клавиатура для выбора дней недели с кнопкой возврата в главное меню"""
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="Понедельник"), KeyboardButton(text="Вторник")],
-            [KeyboardButton(text="Среда"), KeyboardButton(text="Четверг")],
-            [KeyboardButton(text="Пятница"), KeyboardButton(text="Суббота")],
-            [KeyboardButton(text="Воскресенье")],
-            [KeyboardButton(text="✅ Завершить выбор дней")],
-            [KeyboardButton(text="↩️ В главное меню")]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True
-    )
-    return keyboard
-
-def get_time_input_keyboard():
-    """Клавиатура для ввода времени с кнопкой возврата в главное меню"""
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="↩️ В главное меню")]],
-        resize_keyboard=True,
-        one_time_keyboard=True
-    )
+# Очередь отправки уведомлений
+notifier = NotificationScheduler(
+    bot, NOTIFY_DB_FILE, global_rate=NOTIFY_RATE, max_queue=NOTIFY_MAX_QUEUE, digest_window=NOTIFY_DIGEST_WINDOW
+)
+
+# Длина одного сообщения со списком записей (лимит Telegram - 4096 символов)
+MAX_LIST_LENGTH = 4000
+
+def format_bookings(title, records, with_client=False):
+    """Текст списка записей; если список не помещается в сообщение, он обрезается"""
+    text = f"{title}\n"
+    for shown, record in enumerate(records):
+        line = f"\n• {record.day}: {record.time_range} — {record.status}"
+        if with_client:
+            line += f"\n  👤 {record.username}, 📞 {record.phone}, 🆔 {record.user_id}"
+        if len(text) + len(line) > MAX_LIST_LENGTH:
+            text += f"\n\n… и еще {len(records) - shown}"
+            break
+        text += line
+    return text
+
+# Напоминания клиентам
+reminders = ReminderScheduler(notifier, REMINDER_DB_FILE)
+
+async def schedule_reminders(record):
+    """Планирует напоминания о ближайшем занятии по подтвержденной записи"""
+    interval = parse_time_range(record.time_range)
+    if interval is None:
+        return
+    now = datetime.now(BOT_TIMEZONE)
+    starts_at = next_occurrence(record.day, interval[0], now)
+    for hours in REMINDER_HOURS:
+        due_at = starts_at - timedelta(hours=hours)
+        if due_at > now:
+            await reminders.add(
+                due_at.timestamp(), record.record_id, record.user_id,
+                f"⏰ Напоминание: запись к психологу {record.day}, {record.time_range}"
+            )
 
 # Функция для проверки корректности времени
 def is_valid_time_range(time_str):
-    """Проверяет корректность формата диапазона времени (например, 9:00-12:00)"""
-    try:
-        if '-' not in time_str:
-            return False, "❌ Используйте формат ЧЧ:MM-ЧЧ:MM (например, 9:00-12:00)"
-        
-        start_time_str, end_time_str = time_str.split('-')
-        
-        # Проверяем оба времени
-        start_time = datetime.strptime(start_time_str.strip(), '%H:%M')
-        end_time = datetime.strptime(end_time_str.strip(), '%H:%M')
-        
-        if start_time >= end_time:
-            return False, "❌ Время начала должно быть раньше времени окончания"
-        
-        return True, "Диапазон времени корректен"
-        
-    except ValueError:
-        return False, "❌ Неверный формат времени. Используйте ЧЧ:MM-ЧЧ:MM (например, 9:00-12:00):"
+    """Проверяет корректность диапазона времени (9:00-12:00, 9-12, с 9 до 12)"""
+    interval = parse_time_range(time_str)
+    if interval is None:
+        return False, "❌ Неверный формат времени. Используйте ЧЧ:MM-ЧЧ:MM (например, 9:00-12:00 или 9-12):"
+    
+    if interval[0] >= interval[1]:
+        return False, "❌ Время начала должно быть раньше времени окончания"
+    
+    return True, "Диапазон времени корректен"
 
 # Функция для отправки уведомлений администратору
-async def send_notification_to_admin(user_data, days_with_times):
-    """Отправка уведомления администратору о новой заявке"""
+async def send_notification_to_admin(user_data, days_with_times, records=()):
+    """Отправка уведомления администратору о новой заявке с кнопками для каждой записи"""
     try:
-        admin_chat_id = os.getenv("ADMIN_ID")  # Замените на нужный ID администратора
+        admin_chat_id = ADMIN_ID
+        if not admin_chat_id:
+            logger.error("ADMIN_ID не задан, уведомление администратору не отправлено")
+            return
         
         notification_text = (
             "🔔 НОВАЯ ЗАЯВКА НА КОНСУЛЬТАЦИЮ\n\n"
@@ -259,8 +350,10 @@ async def send_notification_to_admin(user_data, days_with_times):
         notification_text += "\n📋 Статус: Ожидает подтверждения\n"
         notification_text += "\n⚠️ Свяжитесь с клиентом для подтверждения записи"
         
-        await bot.send_message(chat_id=admin_chat_id, text=notification_text)
-        logger.info(f"Уведомление отправлено администратору о новой заявке")
+        # Отправка идет через очередь с ограничением частоты и повторами
+        reply_markup = get_booking_actions_keyboard(records) if records else None
+        await notifier.enqueue(admin_chat_id, notification_text, reply_markup=reply_markup, kind="admin")
+        logger.info(f"Уведомление администратору о новой заявке поставлено в очередь")
         
     except Exception as e:
         logger.error(f"Ошибка при отправке уведомления администратору: {e}")
@@ -309,11 +402,46 @@ async def cmd_help(message: types.Message, state: FSMContext):
 
 ⚙️ Управление:
 - ↩️ В главное меню» - вернуться в главное меню
+- /my_bookings - ваши заявки и их статус
 
 Для начала работы нажмите /start
     """
     await message.answer(help_text, reply_markup=get_main_keyboard())
 
+@dp.message(Command("my_bookings"))
+async def cmd_my_bookings(message: types.Message, state: FSMContext):
+    if not await wait_storage_ready():
+        await message.answer("⏳ Заявки сейчас недоступны, попробуйте позже.", reply_markup=get_main_keyboard())
+        return
+    records = booking_index.for_user(message.from_user.id)
+    if not records:
+        await message.answer("У вас пока нет заявок.", reply_markup=get_main_keyboard())
+        return
+    await message.answer(
+        format_bookings(f"📋 Ваши заявки ({len(records)}):", records),
+        reply_markup=get_main_keyboard()
+    )
+
+@dp.message(Command("pending"))
+async def cmd_pending(message: types.Message, state: FSMContext):
+    # Команда доступна только администратору
+    if not ADMIN_ID or str(message.from_user.id) != str(ADMIN_ID):
+        return
+    # Необязательный аргумент - день недели: /pending Понедельник
+    parts = message.text.split(maxsplit=1)
+    day = parts[1].strip().capitalize() if len(parts) > 1 else None
+    if not await wait_storage_ready():
+        await message.answer("⏳ Хранилище записей сейчас недоступно, попробуйте позже.")
+        return
+    records = booking_index.with_status(STATUS_PENDING, day)
+    if not records:
+        await message.answer("Заявок, ожидающих подтверждения, нет.")
+        return
+    title = f"⏳ Ожидают подтверждения ({len(records)})"
+    if day:
+        title += f", {day}"
+    await message.answer(format_bookings(title + ":", records, with_client=True))
+
 @dp.message(F.text == "🆘 Помощь")
 async def help_command(message: types.Message, state: FSMContext):
     await cmd_help(message, state)
@@ -381,21 +509,85 @@ async def process_situation(message: types.Message, state: FSMContext):
     situation = message.text.strip()
     if situation.lower() in ["-", "пропустить", "нет", "не хочу"]:
         situation = ""
-        
-    await state.update_data(user_situation=situation)
     
     await message.answer(
-        "📅 Теперь выберите подходящие дни недели для приема:\n\n"
-        "Нажимайте на кнопки с днями недели, которые вам подходят.\n"
-        "Вы можете выбрать несколько дней.\n"
-        "Если хотите удалить день из списка - нажмите на него повторно.\n"
-        "Когда закончите, нажмите «✅ Завершить выбор дней»\n\n",
-        reply_markup=get_days_keyboard()
+        DAYS_PICKER_TEXT,
+        reply_markup=get_days_picker_keyboard([])
     )
     await state.set_state(AppointmentState.choosing_days)
-    await state.update_data(selected_days=[])  # Инициализируем пустой список выбранных дней
+    await state.update_data(user_situation=situation, selected_days=[])  # Инициализируем пустой список выбранных дней
+
+# Выбор дней недели: одно сообщение с inline-клавиатурой, которая редактируется при каждом нажатии
+DAYS_PICKER_TEXT = (
+    "📅 Теперь выберите подходящие дни недели для приема:\n\n"
+    "Нажимайте на кнопки с днями недели, которые вам подходят.\n"
+    "Вы можете выбрать несколько дней.\n"
+    "Если хотите удалить день из списка - нажмите на него повторно.\n"
+    "Когда закончите, нажмите «✅ Завершить выбор дней»"
+)
 
-# Обработка выбора дней недели
+def toggle_day(selected_days, day):
+    """Добавляет день в список выбранных или убирает его"""
+    if day in selected_days:
+        selected_days.remove(day)
+    else:
+        selected_days.append(day)
+    return selected_days
+
+async def finish_days_selection(state: FSMContext, selected_days):
+    """Переходит к вводу времени и возвращает текст подсказки для первого дня"""
+    await state.update_data(
+        selected_days=selected_days,
+        days_with_times={},  # Словарь для хранения времени по дням
+        current_day_index=0  # Индекс текущего дня
+    )
+    await state.set_state(AppointmentState.entering_time_for_days)
+    
+    # Начинаем с первого дня
+    first_day = selected_days[0]
+    return (
+        f"✅ Выбраны дни: {', '.join(selected_days)}\n\n"
+        f"⏰ Теперь введите удобное время для выбранных дней в формате ЧЧ:MM-ЧЧ:MM\n"
+        "Например: 9:00-12:00 или 14:00-16:00\n\n"
+        f"{free_time_text(first_day)}"
+        f"{first_day}:"
+    )
+
+@dp.callback_query(AppointmentState.choosing_days, DayPick.filter())
+async def process_day_pick(callback: types.CallbackQuery, callback_data: DayPick, state: FSMContext):
+    user_data = await state.get_data()
+    selected_days = user_data.get('selected_days', [])
+    
+    if callback_data.action == "toggle" and 0 <= callback_data.day < len(WEEKDAYS):
+        selected_days = toggle_day(selected_days, WEEKDAYS[callback_data.day])
+        await state.update_data(selected_days=selected_days)
+        await callback.answer()
+        await callback.message.edit_reply_markup(reply_markup=get_days_picker_keyboard(selected_days))
+        
+    elif callback_data.action == "done":
+        if not selected_days:
+            await callback.answer("❌ Выберите хотя бы один день", show_alert=True)
+            return
+        text = await finish_days_selection(state, selected_days)
+        await callback.answer()
+        # Сообщение с выбором дней превращается в подсказку для ввода времени
+        await callback.message.edit_text(text)
+        
+    elif callback_data.action == "menu":
+        await callback.answer()
+        await state.clear()
+        await callback.message.edit_reply_markup(reply_markup=None)
+        await callback.message.answer(
+            "❌ Процесс записи прерван. Возвращаемся в главное меню.",
+            reply_markup=get_main_keyboard()
+        )
+
+@dp.callback_query(DayPick.filter())
+async def process_stale_day_pick(callback: types.CallbackQuery):
+    # Кнопки старого сообщения после завершения или отмены выбора дней
+    await callback.answer("Выбор дней уже завершен")
+
+# Текстовый выбор дней (для клавиатуры из предыдущей версии бота)
 @dp.message(AppointmentState.choosing_days)
 async def process_days_selection(message: types.Message, state: FSMContext):
     if message.text == "↩️ В главное меню":
@@ -405,59 +597,19 @@ async def process_days_selection(message: types.Message, state: FSMContext):
     user_data = await state.get_data()
     selected_days = user_data.get('selected_days', [])
     
-    days_of_week = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-    
-    if message.text in days_of_week:
-        if message.text not in selected_days:
-            selected_days.append(message.text)
-            await message.answer(
-                f"✅ День добавлен: {message.text}\n\n"
-                f"Выбранные дни: {', '.join(selected_days)}\n\n"
-                f"Продолжайте выбирать дни или нажмите «✅ Завершить выбор дней»",
-                reply_markup=get_days_keyboard()
-            )
-        else:
-            selected_days.remove(message.text)
-            await message.answer(
-                f"❌ Удален: {message.text}\n\n"
-                f"Выбранные дни: {', '.join(selected_days)}\n\n"
-                f"Продолжайте выбирать дни или нажмите «✅ Завершить выбор дней»",
-                reply_markup=get_days_keyboard()
-            )
-        
+    if message.text in WEEKDAYS:
+        selected_days = toggle_day(selected_days, message.text)
         await state.update_data(selected_days=selected_days)
+        await message.answer(DAYS_PICKER_TEXT, reply_markup=get_days_picker_keyboard(selected_days))
         
-    elif message.text == "✅ Завершить выбор дней":
-        if not selected_days:
-            await message.answer(
-                "❌ Вы не выбрали ни одного дня. Пожалуйста, выберите хотя бы один день:\n\n",
-                reply_markup=get_days_keyboard()
-            )
-            return
-        
-        # Сохраняем выбранные дни и начинаем ввод времени для каждого дня
-        await state.update_data(selected_days=selected_days)
-        await state.update_data(days_with_times={})  # Словарь для хранения времени по дням
-        await state.update_data(current_day_index=0)  # Индекс текущего дня
-        
-        user_data = await state.get_data()
-        selected_days = user_data['selected_days']
-        
-        # Начинаем с первого дня
-        first_day = selected_days[0]
-        await message.answer(
-            f"✅ Выбраны дни: {', '.join(selected_days)}\n\n"
-            f"⏰ Теперь введите удобное время для выбранных дней в формате ЧЧ:MM-ЧЧ:MM\n"
-            "Например: 9:00-12:00 или 14:00-16:00\n\n"
-            f"{first_day}:",
-            reply_markup=get_time_input_keyboard()
-        )
-        await state.set_state(AppointmentState.entering_time_for_days)
+    elif message.text == "✅ Завершить выбор дней" and selected_days:
+        text = await finish_days_selection(state, selected_days)
+        await message.answer(text, reply_markup=get_time_input_keyboard())
         
     else:
         await message.answer(
-            "Пожалуйста, выберите дни недели из предложенных вариантов:\n\n",
-            reply_markup=get_days_keyboard()
+            "Пожалуйста, выберите дни недели кнопками под сообщением:",
+            reply_markup=get_days_picker_keyboard(selected_days)
         )
 
 # Обработка ввода времени для каждого дня
@@ -481,14 +633,21 @@ async def process_time_for_days(message: types.Message, state: FSMContext):
         await message.answer(
             f"{message_text}\n\n"
             f"Введите время для выбранного дня\n\n"
+            f"{free_time_text(current_day)}"
             f"{current_day}:",
             reply_markup=get_time_input_keyboard()
         )
         return
     
-    # Сохраняем время для текущего дня
-    days_with_times[current_day] = message.text.strip()
-    await state.update_data(days_with_times=days_with_times)
+    # Сохраняем время для текущего дня в едином виде ЧЧ:MM-ЧЧ:MM
+    interval = parse_time_range(message.text.strip())
+    time_range = format_time_range(interval)
+    days_with_times[current_day] = time_range
+    
+    # Предупреждаем, если время пересекается с другими заявками
+    conflict_text = ""
+    if storage_ready.is_set() and slot_index.conflicts(current_day, *interval):
+        conflict_text = "⚠️ Это время уже частично занято, психолог свяжется с вами для уточнения\n"
     
     # Переходим к следующему дню
     next_day_index = current_day_index + 1
@@ -496,12 +655,14 @@ async def process_time_for_days(message: types.Message, state: FSMContext):
     if next_day_index < len(selected_days):
         # Есть еще дни для ввода времени
         next_day = selected_days[next_day_index]
-        await state.update_data(current_day_index=next_day_index)
+        await state.update_data(days_with_times=days_with_times, current_day_index=next_day_index)
         
         await message.answer(
-            f"✅ День недели: {current_day}, Время: {message.text.strip()}\n\n"
+            f"✅ День недели: {current_day}, Время: {time_range}\n"
+            f"{conflict_text}\n"
             f"⏰ Теперь введите удобное время для следующего выбранного дня в формате ЧЧ:MM-ЧЧ:MM\n"
             "Например: 9:00-12:00 или 14:00-16:00\n\n"
+            f"{free_time_text(next_day)}"
             f"{next_day}:",
             reply_markup=get_time_input_keyboard()
         )
@@ -512,10 +673,23 @@ async def process_time_for_days(message: types.Message, state: FSMContext):
         user_situation = user_data.get('user_situation', '')
         user_id = message.from_user.id
         
-        # Создаем отдельные записи для каждого дня
-        success = excel_manager.book_multiple_appointments(
-            selected_days, days_with_times, user_name, user_id, user_phone, user_situation
-        )
+        # Повторно отправленная заявка не записывается и не уведомляет администратора еще раз
+        booking_key = booking_idempotency_key(user_id, selected_days, days_with_times, user_phone)
+        duplicate = booking_key in recent_bookings
+        if duplicate:
+            DUPLICATE_BOOKINGS.inc()
+            logger.info(f"Повторная заявка от пользователя {user_id} пропущена")
+            success = True
+        else:
+            # Создаем отдельные записи для каждого дня (запись выполняется в фоновом потоке)
+            records = await booking_writer.submit(
+                booking_storage.book_multiple_appointments,
+                selected_days, days_with_times, user_name, user_id, user_phone, user_situation
+            )
+            success = bool(records)
+            if success:
+                recent_bookings.add(booking_key)
+                index_bookings(records)
         
         if success:
             response = (
@@ -534,14 +708,16 @@ async def process_time_for_days(message: types.Message, state: FSMContext):
                 response += f"• {day}: {time_range}\n"
             
             response += (
-                "\n📞 С вами свяжутся в ближайшее время для уточнения деталей.\n"
+                f"\n{conflict_text}"
+                "📞 С вами свяжутся в ближайшее время для уточнения деталей.\n"
             )
             
             await message.answer(response, reply_markup=get_main_keyboard())
             
             # Отправляем уведомление администратору
-            user_data['user_id'] = user_id
-            await send_notification_to_admin(user_data, days_with_times)
+            if not duplicate:
+                user_data['user_id'] = user_id
+                await send_notification_to_admin(user_data, days_with_times, records)
             
         else:
             await message.answer(
@@ -551,6 +727,66 @@ async def process_time_for_days(message: types.Message, state: FSMContext):
         
         await state.clear()
 
+# Решение администратора по записи: статус, уведомление клиента
+BOOKING_ACTIONS = {
+    "confirm": (
+        STATUS_CONFIRMED,
+        "✅ Ваша запись подтверждена!\n\n📅 {day}: {time_range}"
+    ),
+    "decline": (
+        STATUS_DECLINED,
+        "❌ К сожалению, запись ({day}, {time_range}) отклонена.\n\n"
+        "Вы можете выбрать другое время: «📅 Записаться на прием»"
+    ),
+    "reschedule": (
+        STATUS_RESCHEDULE,
+        "🔁 Время {day}, {time_range} недоступно.\n\n"
+        "📞 С вами свяжутся, чтобы согласовать другое время."
+    ),
+}
+
+@dp.callback_query(BookingAction.filter())
+async def process_booking_action(callback: types.CallbackQuery, callback_data: BookingAction):
+    if not ADMIN_ID or str(callback.from_user.id) != str(ADMIN_ID):
+        await callback.answer("Действие доступно только администратору", show_alert=True)
+        return
+    if callback_data.action not in BOOKING_ACTIONS:
+        await callback.answer()
+        return
+    status, client_text = BOOKING_ACTIONS[callback_data.action]
+    
+    # Статус меняется по номеру строки (id записи) без поиска по таблице, если в
+    # строке все еще запись того же клиента на тот же день
+    day = WEEKDAYS[callback_data.day] if 0 <= callback_data.day < len(WEEKDAYS) else None
+    record = await booking_writer.submit(
+        booking_storage.update_status, callback_data.record_id, status, callback_data.user_id, day
+    )
+    if record is None:
+        await callback.answer("❌ Запись не найдена", show_alert=True)
+        return
+    index_bookings([record])
+    await reminders.cancel(record.record_id)
+    if status == STATUS_CONFIRMED:
+        await schedule_reminders(record)
+    
+    await notifier.enqueue(record.user_id, client_text.format(day=record.day, time_range=record.time_range))
+    await callback.answer(f"{record.day}: {status}")
+    
+    # Убираем кнопки обработанной записи из сообщения администратора
+    if isinstance(callback.message, types.Message) and callback.message.reply_markup:
+        rows = [
+            row for row in callback.message.reply_markup.inline_keyboard
+            if BookingAction.unpack(row[0].callback_data).record_id != record.record_id
+        ]
+        await callback.message.edit_reply_markup(
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+        )
+
+@dp.callback_query(F.data.startswith(f"{BookingAction.__prefix__}:"))
+async def process_outdated_booking_action(callback: types.CallbackQuery):
+    # Кнопки из уведомлений старого формата, без Телеграм ID клиента
+    await callback.answer("Кнопка устарела, найдите заявку через /pending", show_alert=True)
+
 @dp.message(F.text == "↩️ В главное меню")
 async def back_to_main_process(message: types.Message, state: FSMContext):
     current_state = await state.get_state()
@@ -586,13 +822,105 @@ async def handle_other_messages(message: types.Message, state: FSMContext):
             reply_markup=get_main_keyboard()
         )
 
+# Работа через webhook
+class WebhookHandler(SimpleRequestHandler):
+    """Обработчик webhook, который при остановке дожидается фоновых обновлений"""
+    async def close(self):
+        if self._background_feed_update_tasks:
+            logger.info(f"Ожидаем завершения обновлений: {len(self._background_feed_update_tasks)}")
+            await asyncio.wait(self._background_feed_update_tasks, timeout=30)
+        await super().close()
+
+async def on_webhook_startup(bot: Bot):
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"Webhook установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+async def health(request):
+    """Проверка работоспособности для хостинга"""
+    return web.json_response({
+        "status": "ok",
+        "storage_queue": booking_writer.queue.qsize() if booking_writer.queue else 0,
+        "startup": STARTUP.phases,
+        "bot_api": bot.session.stats()
+    })
+
+def create_web_app(webhook=True):
+    app = web.Application()
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics_handler)
+    if webhook:
+        # Ответ Telegram отправляется сразу, обновление обрабатывается в фоне,
+        # поэтому долгая запись в хранилище не задерживает следующие обновления
+        WebhookHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
+    return app
+
+async def start_web_server(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEB_SERVER_HOST, port=WEB_SERVER_PORT)
+    await site.start()
+    logger.info(f"Веб-сервер запущен на {WEB_SERVER_HOST}:{WEB_SERVER_PORT}")
+    return runner
+
+async def run_webhook():
+    """Запускает веб-сервер и работает до сигнала остановки"""
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для режима webhook задайте WEBHOOK_URL")
+    dp.startup.register(on_webhook_startup)
+    
+    runner = await start_web_server(create_web_app())
+    STARTUP.mark("ready")
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Остановка веб-сервера...")
+        await runner.cleanup()
+
 # Основная функция
 async def main():
-    # Инициализируем Excel файл
-    init_excel_file()
+    # Хранилище записей открывается в фоне (файл Excel создается при необходимости)
+    booking_writer.start()
+    
+    notifier.start()
+    reminders.start()
+    
+    background_tasks = [asyncio.create_task(monitor_event_loop_lag()), asyncio.create_task(prepare_storage())]
+    if isinstance(booking_storage, ExcelManager) and booking_storage.resident:
+        background_tasks.append(asyncio.create_task(flush_storage_periodically()))
+    if isinstance(booking_storage, SQLiteStorage) and EXCEL_EXPORT_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(export_excel_periodically()))
     
     logger.info("Бот запущен и готов к работе!")
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            # При long polling /health и /metrics доступны, если хостинг задал PORT
+            runner = await start_web_server(create_web_app(webhook=False)) if os.getenv("PORT") else None
+            try:
+                STARTUP.mark("ready")
+                await dp.start_polling(bot)
+            finally:
+                if runner:
+                    await runner.cleanup()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await reminders.stop()
+        await notifier.stop()
+        # Принудительно сохраняем все накопленные строки перед выходом
+        await booking_writer.submit(booking_storage.close)
+        await booking_writer.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,232 @@
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Метрики в текстовом формате Prometheus без сторонних зависимостей.
+# Значения могут обновляться из потока записи в хранилище, поэтому
+# изменения защищены блокировкой
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _labels(self, labelvalues, extra=()):
+        pairs = list(zip(self.labelnames, labelvalues)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+    def samples(self):
+        return []
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for labelvalues, value in items:
+            yield f"{self.name}{self._labels(labelvalues)} {value}"
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def set(self, value, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = value
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for labelvalues, value in items:
+            yield f"{self.name}{self._labels(labelvalues)} {value}"
+
+class Histogram(Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики по корзинам (+Inf последней), сумма]
+        self.values = {}
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labelvalues)
+            if entry is None:
+                entry = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def samples(self):
+        with self.lock:
+            items = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self.values.items()]
+        for labelvalues, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket{self._labels(labelvalues, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{self._labels(labelvalues)} {total}"
+            yield f"{self.name}_count{self._labels(labelvalues)} {cumulative}"
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+REGISTRY = Registry()
+
+UPDATES_TOTAL = Counter("bot_updates_total", "Обновления по состоянию FSM на момент получения", ["state"])
+UPDATE_SECONDS = Histogram("bot_update_duration_seconds", "Полное время обработки обновления", ["state"])
+HANDLER_SECONDS = Histogram("bot_handler_duration_seconds", "Время работы обработчика", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ["handler"])
+STORAGE_SECONDS = Histogram("bot_storage_operation_seconds", "Операции хранилища записей", ["operation"])
+STORAGE_QUEUE_WAIT_SECONDS = Histogram("bot_storage_queue_wait_seconds", "Ожидание в очереди записи в хранилище")
+STORAGE_QUEUE_DEPTH = Gauge("bot_storage_queue_depth", "Очередь записи в хранилище перед последним запросом")
+API_SECONDS = Histogram("bot_api_request_duration_seconds", "Запросы к Bot API", ["method"])
+API_ERRORS = Counter("bot_api_errors_total", "Ошибки запросов к Bot API", ["method", "error"])
+API_IN_FLIGHT = Gauge("bot_api_requests_in_flight", "Запросы к Bot API, ожидающие ответа")
+API_POOL_WAIT_SECONDS = Histogram("bot_api_pool_wait_seconds", "Ожидание свободного соединения в пуле Bot API")
+API_CONNECTIONS = Counter("bot_api_connections_total", "Соединения с Bot API: новые и повторно использованные", ["kind"])
+DUPLICATE_UPDATES = Counter("bot_duplicate_updates_total", "Пропущенные повторные обновления")
+DUPLICATE_BOOKINGS = Counter("bot_duplicate_bookings_total", "Повторные заявки, не записанные в хранилище")
+THROTTLED_UPDATES = Counter("bot_throttled_updates_total", "Обновления, отброшенные ограничением частоты", ["event"])
+LOOP_LAG = Gauge("bot_event_loop_lag_seconds", "Последняя измеренная задержка цикла событий")
+LOOP_LAG_SECONDS = Histogram("bot_event_loop_lag_histogram_seconds", "Задержка цикла событий")
+STARTUP_SECONDS = Gauge("bot_startup_seconds", "Время от начала импорта main.py до этапа запуска", ["phase"])
+
+class StartupTimer:
+    """Отметки этапов холодного старта: каждый этап записывается один раз"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, phase):
+        if phase in self.phases:
+            return
+        elapsed = time.perf_counter() - self.started
+        self.phases[phase] = round(elapsed, 3)
+        STARTUP_SECONDS.set(elapsed, phase)
+        logger.info(f"Запуск: {phase} через {elapsed:.3f} с")
+
+STARTUP = StartupTimer()
+
+class UpdateMetricsMiddleware:
+    """Внешний middleware: считает обновления по состоянию FSM и время их обработки.
+
+    Регистрируется после FSM-middleware, чтобы в данных уже было raw_state.
+    """
+
+    async def __call__(self, handler, event, data):
+        state = data.get("raw_state") or "none"
+        UPDATES_TOTAL.inc(state)
+        try:
+            with UPDATE_SECONDS.time(state):
+                return await handler(event, data)
+        finally:
+            STARTUP.mark("first_update")
+
+class HandlerMetricsMiddleware:
+    """Внутренний middleware: время работы конкретного обработчика"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+class RequestMetricsMiddleware:
+    """Middleware сессии бота: время каждого запроса к Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, name)
+
+def setup_metrics(dispatcher, bot):
+    """Подключает сбор метрик к диспетчеру и сессии бота"""
+    dispatcher.update.outer_middleware(UpdateMetricsMiddleware())
+    dispatcher.message.middleware(HandlerMetricsMiddleware())
+    dispatcher.callback_query.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(RequestMetricsMiddleware())
+
+async def monitor_event_loop_lag(interval=0.5):
+    """Измеряет, насколько позже запланированного просыпается цикл событий"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_SECONDS.observe(lag)
+        if lag > 1:
+            logger.warning(f"Цикл событий заблокирован на {lag:.2f} с")
+
+async def metrics_handler(request):
+    """Страница /metrics для Prometheus"""
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
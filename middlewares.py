@@ -0,0 +1,254 @@
+import copy
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StorageKey
+
+from metrics import DUPLICATE_UPDATES, THROTTLED_UPDATES
+
+logger = logging.getLogger(__name__)
+
+class BufferedFSMContext(FSMContext):
+    """Контекст FSM, который читает состояние один раз за обновление.
+
+    После load() все изменения копятся в памяти и записываются в хранилище
+    одной операцией в commit(). До вызова load() контекст работает как обычный.
+    """
+
+    def __init__(self, storage, key):
+        super().__init__(storage=storage, key=key)
+        self.loaded = False
+        self.changed = False
+        self.state = None
+        self.data = {}
+
+    async def load(self):
+        """Загружает состояние и данные из хранилища"""
+        if hasattr(self.storage, "get_record"):
+            self.state, self.data = await self.storage.get_record(self.key)
+        else:
+            self.state = await self.storage.get_state(self.key)
+            self.data = await self.storage.get_data(self.key)
+        self.loaded = True
+        self.changed = False
+
+    async def commit(self):
+        """Записывает накопленные изменения в хранилище"""
+        if not self.loaded or not self.changed:
+            return
+        if hasattr(self.storage, "set_record"):
+            await self.storage.set_record(self.key, self.state, self.data)
+        else:
+            await self.storage.set_state(self.key, self.state)
+            await self.storage.set_data(self.key, self.data)
+        self.changed = False
+
+    async def set_state(self, state=None):
+        if not self.loaded:
+            return await super().set_state(state)
+        self.state = state.state if isinstance(state, State) else state
+        self.changed = True
+
+    async def get_state(self):
+        if not self.loaded:
+            return await super().get_state()
+        return self.state
+
+    async def set_data(self, data):
+        if not self.loaded:
+            return await super().set_data(data)
+        self.data = copy.deepcopy(data)
+        self.changed = True
+
+    async def get_data(self):
+        if not self.loaded:
+            return await super().get_data()
+        return copy.deepcopy(self.data)
+
+    async def update_data(self, data=None, **kwargs):
+        if not self.loaded:
+            return await super().update_data(data, **kwargs)
+        if data:
+            kwargs.update(data)
+        self.data.update(copy.deepcopy(kwargs))
+        self.changed = True
+        return copy.deepcopy(self.data)
+
+class BufferedFSMContextMiddleware(FSMContextMiddleware):
+    """Замена стандартного FSMContextMiddleware: одно чтение и не более одной записи на обновление"""
+
+    async def __call__(self, handler, event, data):
+        context = self.resolve_event_context(data["bot"], data)
+        data["fsm_storage"] = self.storage
+        if context:
+            async with self.events_isolation.lock(key=context.key):
+                await context.load()
+                data.update({"state": context, "raw_state": context.state})
+                try:
+                    return await handler(event, data)
+                finally:
+                    await context.commit()
+        return await handler(event, data)
+
+    def get_context(self, bot, chat_id, user_id, thread_id=None, business_connection_id=None, destiny="default"):
+        return BufferedFSMContext(
+            storage=self.storage,
+            key=StorageKey(
+                user_id=user_id,
+                chat_id=chat_id,
+                bot_id=bot.id,
+                thread_id=thread_id,
+                business_connection_id=business_connection_id,
+                destiny=destiny,
+            ),
+        )
+
+def setup_buffered_fsm(dispatcher):
+    """Подменяет FSM-middleware диспетчера на буферизующее"""
+    middleware = BufferedFSMContextMiddleware(
+        storage=dispatcher.fsm.storage,
+        events_isolation=dispatcher.fsm.events_isolation,
+        strategy=dispatcher.fsm.strategy,
+    )
+    dispatcher.update.outer_middleware.unregister(dispatcher.fsm)
+    dispatcher.update.outer_middleware.register(middleware)
+    dispatcher.fsm = middleware
+    return middleware
+
+class TTLCache:
+    """Множество ключей ограниченного размера, каждый ключ живет ttl секунд"""
+
+    def __init__(self, maxsize=10000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # ключ -> момент истечения; порядок вставки совпадает с порядком истечения
+        self.items = OrderedDict()
+
+    def _expire(self):
+        now = time.monotonic()
+        while self.items:
+            key, expires_at = next(iter(self.items.items()))
+            if expires_at > now:
+                break
+            del self.items[key]
+
+    def __contains__(self, key):
+        self._expire()
+        return key in self.items
+
+    def add(self, key):
+        """Добавляет ключ; возвращает False, если он уже был"""
+        self._expire()
+        if key in self.items:
+            return False
+        self.items[key] = time.monotonic() + self.ttl
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return True
+
+    def __len__(self):
+        return len(self.items)
+
+class DeduplicationMiddleware:
+    """Внешний middleware: пропускает повторно доставленные обновления.
+
+    Telegram может прислать то же обновление еще раз (после перезапуска
+    polling или повтора webhook). Обновление считается повтором, если его
+    update_id или пара чат/сообщение уже встречались за последние ttl секунд.
+    """
+
+    def __init__(self, maxsize=10000, ttl=600):
+        self.seen = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def __call__(self, handler, event, data):
+        keys = [("update", event.update_id)]
+        if event.message is not None:
+            keys.append(("message", event.message.chat.id, event.message.message_id))
+        if any(key in self.seen for key in keys):
+            DUPLICATE_UPDATES.inc()
+            logger.info(f"Повторное обновление {event.update_id} пропущено")
+            return None
+        for key in keys:
+            self.seen.add(key)
+        return await handler(event, data)
+
+def setup_deduplication(dispatcher, maxsize=10000, ttl=600):
+    """Подключает отсечение повторных обновлений (до FSM, чтобы не читать состояние)"""
+    middleware = DeduplicationMiddleware(maxsize=maxsize, ttl=ttl)
+    dispatcher.update.outer_middleware(middleware)
+    return middleware
+
+class ThrottlingMiddleware:
+    """Внешний middleware: ограничивает частоту обновлений от одного пользователя.
+
+    Используется счетчик скользящего окна: на пользователя хранятся номер
+    текущего окна и число обновлений в нем и в предыдущем, оценка частоты -
+    взвешенная сумма двух окон. Пользователи хранятся в OrderedDict с
+    вытеснением давно неактивных (LRU), поэтому память ограничена max_users.
+    Лишние обновления отбрасываются до чтения состояния FSM; о превышении
+    пользователь узнает одним сообщением (или ответом на нажатие кнопки) за окно,
+    а на остальные отброшенные нажатия кнопок отправляется пустой ответ.
+    """
+
+    def __init__(self, limit=20, window=10, max_users=10000, exempt_ids=()):
+        self.limit = limit
+        self.window = window
+        self.max_users = max_users
+        self.exempt_ids = {str(user_id) for user_id in exempt_ids}
+        # user_id -> [номер окна, обновлений в предыдущем окне, в текущем, предупрежден]
+        self.users = OrderedDict()
+
+    def allow(self, user_id, now=None):
+        """Учитывает обновление и возвращает (пропустить, нужно ли предупредить)"""
+        position = (time.monotonic() if now is None else now) / self.window
+        window_index = int(position)
+        entry = self.users.get(user_id)
+        if entry is None:
+            entry = self.users[user_id] = [window_index, 0, 0, False]
+            if len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_id)
+            if entry[0] != window_index:
+                # Предыдущим становится текущее окно, если оно соседнее, иначе пустое
+                entry[1] = entry[2] if entry[0] == window_index - 1 else 0
+                entry[0], entry[2], entry[3] = window_index, 0, False
+
+        estimate = entry[1] * (1 - (position - window_index)) + entry[2]
+        if estimate >= self.limit:
+            warn = not entry[3]
+            entry[3] = True
+            return False, warn
+        entry[2] += 1
+        return True, False
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or str(user.id) in self.exempt_ids:
+            return await handler(event, data)
+        allowed, warn = self.allow(user.id)
+        if allowed:
+            return await handler(event, data)
+
+        THROTTLED_UPDATES.inc(event.event_type)
+        if warn:
+            logger.info(f"Пользователь {user.id} превысил лимит обновлений")
+            if event.message is not None:
+                await event.message.answer("⏳ Слишком много сообщений. Пожалуйста, подождите несколько секунд.")
+        if event.callback_query is not None:
+            # На каждое нажатие нужен ответ, иначе у клиента крутятся часы на кнопке;
+            # текст предупреждения - только в первом ответе за окно
+            await event.callback_query.answer(
+                "⏳ Слишком много нажатий. Пожалуйста, подождите несколько секунд." if warn else None
+            )
+        return None
+
+def setup_throttling(dispatcher, limit=20, window=10, max_users=10000, exempt_ids=()):
+    """Подключает ограничение частоты (до FSM, чтобы лишние обновления не читали состояние)"""
+    middleware = ThrottlingMiddleware(limit=limit, window=window, max_users=max_users, exempt_ids=exempt_ids)
+    dispatcher.update.outer_middleware(middleware)
+    return middleware
@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.types import InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+# Кнопок в одном дайджесте не больше, чем Telegram принимает в одной клавиатуре
+MAX_DIGEST_BUTTONS = 100
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self):
+        """Через сколько секунд появится токен"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def full(self):
+        """Бак полон: такой же, как только что созданный"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+class NotificationScheduler:
+    """Очередь исходящих уведомлений с ограничением частоты и повторными попытками.
+
+    Сообщения сначала сохраняются в SQLite, поэтому переживают перезапуск бота.
+    Отправка ограничена общим лимитом и лимитом на каждый чат, при ответе
+    RetryAfter выдерживается пауза, указанная Telegram, а при сетевых ошибках
+    попытка повторяется с растущей задержкой. Если задан digest_window,
+    уведомления администратора (kind="admin"), пришедшие за это время,
+    объединяются в одно сообщение, а их кнопки - в одну клавиатуру.
+    Сообщения клиентам всегда отправляются по одному. Запросы к базе
+    выполняются в отдельном потоке, чтобы не останавливать цикл событий.
+    """
+
+    def __init__(self, bot, db_path, global_rate=25, chat_rate=1, max_queue=1000,
+                 max_attempts=5, digest_window=0, max_chat_buckets=1000):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}
+        self.max_chat_buckets = max_chat_buckets
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.digest_window = digest_window
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.sent_count = 0
+        self.dropped_count = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # Запросы идут из потоков asyncio.to_thread, транзакции не должны перемешиваться
+        self.lock = threading.Lock()
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "chat_id TEXT NOT NULL, "
+                "text TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "reply_markup TEXT, "
+                "kind TEXT NOT NULL DEFAULT 'client')"
+            )
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+            if "reply_markup" not in columns:
+                self.conn.execute("ALTER TABLE outbox ADD COLUMN reply_markup TEXT")
+            if "kind" not in columns:
+                self.conn.execute("ALTER TABLE outbox ADD COLUMN kind TEXT NOT NULL DEFAULT 'client'")
+        # Счетчик сообщений в очереди, чтобы не считать COUNT(*) на каждое добавление
+        self.pending = self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def pending_count(self):
+        return self.pending
+
+    def merge(self, db_path):
+        """Переносит неотправленные сообщения из другой базы очереди, вызывается до start"""
+        # Схема старой базы обновляется так же, как своя
+        other = NotificationScheduler(None, db_path)
+        rows = other.conn.execute("SELECT chat_id, text, reply_markup, kind FROM outbox ORDER BY id").fetchall()
+        other.conn.close()
+        for row in rows:
+            self._insert(*row)
+        return len(rows)
+
+    async def _db(self, function, *args):
+        """Выполняет запрос к базе в отдельном потоке"""
+        return await asyncio.to_thread(self._locked, function, *args)
+
+    def _locked(self, function, *args):
+        with self.lock:
+            return function(*args)
+
+    async def enqueue(self, chat_id, text, reply_markup=None, kind="client"):
+        """Сохраняет уведомление (и при необходимости inline-клавиатуру) в очередь на отправку.
+
+        kind="admin" - уведомление администратора, его можно объединить в дайджест.
+        """
+        markup_json = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+        await self._db(self._insert, str(chat_id), text, markup_json, kind)
+        self.wakeup.set()
+
+    def _insert(self, chat_id, text, markup_json, kind):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO outbox (chat_id, text, reply_markup, kind) VALUES (?, ?, ?, ?)",
+                (chat_id, text, markup_json, kind)
+            )
+            self.pending += 1
+            overflow = self.pending - self.max_queue
+            if overflow > 0:
+                # Очередь ограничена: вытесняем самые старые сообщения
+                deleted = self.conn.execute(
+                    "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)", (overflow,)
+                ).rowcount
+                self.pending -= deleted
+                self.dropped_count += deleted
+                logger.warning(f"Очередь уведомлений переполнена, удалено старых сообщений: {deleted}")
+
+    def _fetch(self):
+        return self.conn.execute(
+            "SELECT id, chat_id, text, attempts, reply_markup, kind FROM outbox ORDER BY id LIMIT 100"
+        ).fetchall()
+
+    def _set_attempts(self, ids, attempts):
+        with self.conn:
+            self.conn.executemany("UPDATE outbox SET attempts = ? WHERE id = ?", [(attempts, row_id) for row_id in ids])
+
+    def _delete(self, ids):
+        with self.conn:
+            deleted = self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in ids]).rowcount
+        # Строки могли быть уже вытеснены при переполнении
+        self.pending -= deleted
+
+    def start(self):
+        """Запускает отправку, включая сообщения, оставшиеся с прошлого запуска"""
+        pending = self.pending_count()
+        if pending:
+            logger.info(f"В очереди уведомлений с прошлого запуска: {pending}")
+            self.wakeup.set()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает отправку, неотправленные сообщения остаются в базе"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        with self.lock:
+            self.conn.close()
+        logger.info(f"Очередь уведомлений остановлена: отправлено {self.sent_count}, вытеснено {self.dropped_count}")
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            if self.digest_window:
+                # Даем накопиться заявкам, пришедшим почти одновременно
+                await asyncio.sleep(self.digest_window)
+            self.wakeup.clear()
+            while True:
+                rows = await self._db(self._fetch)
+                if not rows:
+                    break
+                for chat_id, ids, text, attempts, markup_json in self._batches(rows):
+                    await self._deliver(chat_id, ids, text, attempts, markup_json)
+
+    def _batches(self, rows):
+        """Группирует уведомления администратора в дайджесты по чатам, остальные отдает по одному"""
+        by_chat = {}
+        for row_id, chat_id, text, attempts, markup_json, kind in rows:
+            if not self.digest_window or kind != "admin":
+                yield chat_id, [row_id], text, attempts, markup_json
+            else:
+                keyboard = json.loads(markup_json)["inline_keyboard"] if markup_json else []
+                by_chat.setdefault(chat_id, []).append((row_id, text, attempts, keyboard))
+        for chat_id, chat_rows in by_chat.items():
+            # Каждый дайджест не длиннее одного сообщения Telegram и с ограниченным числом кнопок
+            ids, texts, keyboard, attempts = [], [], [], 0
+            for row_id, text, row_attempts, row_keyboard in chat_rows:
+                buttons = sum(len(row) for row in keyboard + row_keyboard)
+                if texts and (len(self._digest_text(texts + [text])) > MAX_MESSAGE_LENGTH or buttons > MAX_DIGEST_BUTTONS):
+                    yield chat_id, ids, self._digest_text(texts), attempts, self._keyboard_json(keyboard)
+                    ids, texts, keyboard, attempts = [], [], [], 0
+                ids.append(row_id)
+                texts.append(text)
+                keyboard.extend(row_keyboard)
+                attempts = max(attempts, row_attempts)
+            yield chat_id, ids, self._digest_text(texts), attempts, self._keyboard_json(keyboard)
+
+    @staticmethod
+    def _digest_text(texts):
+        if len(texts) == 1:
+            return texts[0]
+        return f"📬 Новых заявок: {len(texts)}\n\n" + "\n\n— — —\n\n".join(texts)
+
+    @staticmethod
+    def _keyboard_json(keyboard):
+        return json.dumps({"inline_keyboard": keyboard}, ensure_ascii=False) if keyboard else None
+
+    async def _wait_for_token(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.max_chat_buckets:
+                # Полные баки ничем не отличаются от новых, поэтому их можно удалить:
+                # остаются только чаты, которым писали в последние 1 / chat_rate секунд
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.full()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        while True:
+            delay = max(self.global_bucket.delay(), bucket.delay())
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+        self.global_bucket.take()
+        bucket.take()
+
+    async def _deliver(self, chat_id, ids, text, attempts, markup_json=None):
+        reply_markup = InlineKeyboardMarkup.model_validate_json(markup_json) if markup_json else None
+        while True:
+            await self._wait_for_token(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+            except TelegramRetryAfter as e:
+                logger.warning(f"Превышен лимит Telegram, пауза {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    logger.error(f"Уведомление не отправлено после {attempts} попыток: {e}")
+                    break
+                await self._db(self._set_attempts, ids, attempts)
+                delay = min(60, 2 ** attempts)
+                logger.warning(f"Ошибка при отправке уведомления, повтор через {delay} с: {e}")
+                await asyncio.sleep(delay)
+                continue
+            except Exception as e:
+                # Повтор не поможет (например, неверный chat_id или бот заблокирован)
+                logger.error(f"Ошибка при отправке уведомления: {e}")
+                break
+            self.sent_count += 1
+            break
+        await self._db(self._delete, ids)
@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class ReminderScheduler:
+    """Напоминания клиентам о подтвержденных записях.
+
+    Время отправки хранится в SQLite, а в памяти - в куче (heapq) с ближайшим
+    напоминанием наверху. Задача спит до ближайшего срока или до появления
+    более раннего напоминания, поэтому в простое не тратит процессор при
+    любом числе ожидающих напоминаний. Наступившие напоминания передаются
+    пачкой в очередь уведомлений, которая соблюдает лимиты Telegram. Запись
+    в базу выполняется в отдельном потоке, а куча меняется только в цикле событий.
+    """
+
+    def __init__(self, notifier, db_path, batch_size=500):
+        self.notifier = notifier
+        self.batch_size = batch_size
+        self.heap = []
+        # Отмененные напоминания удаляются из кучи лениво, при извлечении
+        self.cancelled = set()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.sent_count = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.Lock()
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS reminders ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "due_at REAL NOT NULL, "
+                "record_id TEXT NOT NULL, "
+                "chat_id TEXT NOT NULL, "
+                "text TEXT NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_record_id ON reminders (record_id)")
+
+    def __len__(self):
+        return len(self.heap) - len(self.cancelled)
+
+    def merge(self, db_path):
+        """Переносит напоминания из другой базы, вызывается до start"""
+        other = sqlite3.connect(db_path)
+        rows = other.execute("SELECT due_at, record_id, chat_id, text FROM reminders").fetchall()
+        other.close()
+        with self.conn:
+            self.conn.executemany("INSERT INTO reminders (due_at, record_id, chat_id, text) VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def load(self):
+        """Восстанавливает кучу из базы"""
+        self.heap = self.conn.execute("SELECT due_at, id FROM reminders").fetchall()
+        heapq.heapify(self.heap)
+        self.cancelled.clear()
+        logger.info(f"Загружено напоминаний: {len(self.heap)}")
+
+    async def _db(self, function, *args):
+        """Выполняет запрос к базе в отдельном потоке"""
+        return await asyncio.to_thread(self._locked, function, *args)
+
+    def _locked(self, function, *args):
+        with self.lock:
+            return function(*args)
+
+    async def add(self, due_at, record_id, chat_id, text):
+        """Планирует напоминание на момент due_at (секунды Unix)"""
+        reminder_id = await self._db(self._insert, due_at, str(record_id), str(chat_id), text)
+        # Будим задачу, только если новое напоминание станет ближайшим
+        if not self.heap or due_at < self.heap[0][0]:
+            self.wakeup.set()
+        heapq.heappush(self.heap, (due_at, reminder_id))
+
+    async def cancel(self, record_id):
+        """Отменяет напоминания о записи"""
+        ids = await self._db(self._delete_record, str(record_id))
+        self.cancelled.update(ids)
+        return len(ids)
+
+    def _insert(self, due_at, record_id, chat_id, text):
+        with self.conn:
+            return self.conn.execute(
+                "INSERT INTO reminders (due_at, record_id, chat_id, text) VALUES (?, ?, ?, ?)",
+                (due_at, record_id, chat_id, text)
+            ).lastrowid
+
+    def _delete_record(self, record_id):
+        with self.conn:
+            ids = [row[0] for row in self.conn.execute("SELECT id FROM reminders WHERE record_id = ?", (record_id,))]
+            self.conn.execute("DELETE FROM reminders WHERE record_id = ?", (record_id,))
+        return ids
+
+    def _fetch(self, due_ids):
+        placeholders = ",".join("?" * len(due_ids))
+        return self.conn.execute(f"SELECT chat_id, text FROM reminders WHERE id IN ({placeholders})", due_ids).fetchall()
+
+    def _delete(self, due_ids):
+        placeholders = ",".join("?" * len(due_ids))
+        with self.conn:
+            self.conn.execute(f"DELETE FROM reminders WHERE id IN ({placeholders})", due_ids)
+
+    def start(self):
+        self.load()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает отправку, ожидающие напоминания остаются в базе"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        with self.lock:
+            self.conn.close()
+        logger.info(f"Напоминания остановлены: отправлено {self.sent_count}, ожидают {len(self)}")
+
+    def _pop_due(self, now):
+        due_ids = []
+        while self.heap and self.heap[0][0] <= now and len(due_ids) < self.batch_size:
+            _, reminder_id = heapq.heappop(self.heap)
+            if reminder_id in self.cancelled:
+                self.cancelled.discard(reminder_id)
+                continue
+            due_ids.append(reminder_id)
+        return due_ids
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due_ids = self._pop_due(time.time())
+            if not due_ids:
+                continue
+            rows = await self._db(self._fetch, due_ids)
+            for chat_id, text in rows:
+                await self.notifier.enqueue(chat_id, text)
+            await self._db(self._delete, due_ids)
+            self.sent_count += len(rows)
+            logger.info(f"Отправлено напоминаний: {len(rows)}")
@@ -0,0 +1,133 @@
+import bisect
+import logging
+from datetime import datetime, timedelta
+
+from storage import STATUS_CONFIRMED, STATUS_PENDING
+from timeparse import parse_time_range
+
+logger = logging.getLogger(__name__)
+
+# Рабочее время по умолчанию, в минутах от начала суток
+DAY_START = 9 * 60
+DAY_END = 21 * 60
+
+WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+# Записи с этими статусами занимают время
+BUSY_STATUSES = {STATUS_PENDING, STATUS_CONFIRMED}
+
+class DaySchedule:
+    """Занятые интервалы одного дня в массиве, отсортированном по началу.
+
+    Пересекающиеся с [start, end) интервалы начинаются не раньше
+    start - max_length и раньше end, поэтому их границы находятся
+    двоичным поиском. Объединенные занятые интервалы для поиска
+    свободного времени пересчитываются только после изменений.
+    """
+
+    def __init__(self):
+        self.intervals = []
+        self.max_length = 0
+        self.merged = None
+
+    def add(self, start, end, record_id):
+        bisect.insort(self.intervals, (start, end, record_id))
+        self.max_length = max(self.max_length, end - start)
+        self.merged = None
+
+    def remove(self, start, end, record_id):
+        index = bisect.bisect_left(self.intervals, (start, end, record_id))
+        if index < len(self.intervals) and self.intervals[index] == (start, end, record_id):
+            del self.intervals[index]
+            self.merged = None
+
+    def conflicts(self, start, end):
+        """Занятые интервалы, пересекающиеся с [start, end)"""
+        low = bisect.bisect_left(self.intervals, (start - self.max_length,))
+        high = bisect.bisect_left(self.intervals, (end,))
+        return [interval for interval in self.intervals[low:high] if interval[1] > start]
+
+    def busy(self):
+        if self.merged is None:
+            merged = []
+            for start, end, _ in self.intervals:
+                if merged and start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self.merged = merged
+        return self.merged
+
+    def free(self, day_start, day_end):
+        """Свободные промежутки внутри [day_start, day_end)"""
+        busy = self.busy()
+        # Пропускаем занятые интервалы, закончившиеся до начала рабочего дня
+        index = bisect.bisect_right(busy, [day_start, day_start])
+        if index and busy[index - 1][1] > day_start:
+            index -= 1
+        slots = []
+        cursor = day_start
+        for start, end in busy[index:]:
+            if start >= day_end:
+                break
+            if start > cursor:
+                slots.append((cursor, start))
+            cursor = max(cursor, end)
+        if cursor < day_end:
+            slots.append((cursor, day_end))
+        return slots
+
+class SlotIndex:
+    """Занятое время по дням недели, построенное по записям хранилища"""
+
+    def __init__(self, day_start=DAY_START, day_end=DAY_END):
+        self.day_start = day_start
+        self.day_end = day_end
+        self.days = {}
+        # record_id -> (день, начало, конец) для удаления записи при смене статуса
+        self.records = {}
+
+    def load(self, records):
+        """Заполняет индекс заново"""
+        self.days = {}
+        self.records = {}
+        self.add_many(records)
+        logger.info(f"Индекс занятого времени построен: {len(self.records)}")
+
+    def add(self, record):
+        if record.status not in BUSY_STATUSES:
+            return
+        interval = parse_time_range(record.time_range)
+        if interval is None or interval[0] >= interval[1]:
+            return
+        self.days.setdefault(record.day, DaySchedule()).add(*interval, record.record_id)
+        self.records[record.record_id] = (record.day, *interval)
+
+    def add_many(self, records):
+        for record in records:
+            self.add(record)
+
+    def remove(self, record_id):
+        entry = self.records.pop(record_id, None)
+        if entry is not None:
+            day, start, end = entry
+            self.days[day].remove(start, end, record_id)
+
+    def conflicts(self, day, start, end):
+        schedule = self.days.get(day)
+        return schedule.conflicts(start, end) if schedule else []
+
+    def free_slots(self, day):
+        schedule = self.days.get(day)
+        if schedule is None:
+            return [(self.day_start, self.day_end)]
+        return schedule.free(self.day_start, self.day_end)
+
+def next_occurrence(day, start_minute, now):
+    """Ближайшие день недели и время начала записи после now (datetime с часовым поясом)"""
+    days_ahead = (WEEKDAYS.index(day) - now.weekday()) % 7
+    start = datetime.combine(now.date(), datetime.min.time(), tzinfo=now.tzinfo)
+    start += timedelta(days=days_ahead, minutes=start_minute)
+    if start <= now:
+        start += timedelta(days=7)
+    return start
@@ -0,0 +1,132 @@
+import logging
+import time
+
+from aiogram import __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiohttp import ClientSession, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+
+from metrics import API_CONNECTIONS, API_IN_FLIGHT, API_POOL_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+def api_server(api_url=None, is_local=False):
+    """Адрес Bot API: api.telegram.org или свой сервер (например, локальный telegram-bot-api)"""
+    if not api_url:
+        return PRODUCTION
+    return TelegramAPIServer.from_base(api_url, is_local=is_local)
+
+def parse_method_timeouts(text):
+    """Разбирает таймауты вида "sendMessage=10,answerCallbackQuery=5" """
+    timeouts = {}
+    for item in text.split(","):
+        if item.strip():
+            method, _, seconds = item.partition("=")
+            timeouts[method.strip()] = float(seconds)
+    return timeouts
+
+class BotSession(AiohttpSession):
+    """Сессия Bot API с настраиваемым пулом соединений.
+
+    Сериализует статические клавиатуры только один раз, задает таймауты по
+    методам и считает для метрик запросы в работе, ожидание свободного
+    соединения и повторное использование соединений, чтобы по ним подбирать
+    размер пула под часы пик.
+    """
+
+    def __init__(
+        self, static_markups=(), limit=100, limit_per_host=0, keepalive_timeout=15,
+        dns_cache_ttl=3600, method_timeouts=None, **kwargs
+    ):
+        super().__init__(limit=limit, **kwargs)
+        # Храним сами объекты, чтобы их id оставались действительными
+        self.static_markups = {id(markup): markup for markup in static_markups}
+        self.markup_json = {}
+        self._connector_init.update(
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=dns_cache_ttl > 0,
+            ttl_dns_cache=dns_cache_ttl or None,
+        )
+        self.limit = limit
+        self.method_timeouts = method_timeouts or {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.connections = {"new": 0, "reused": 0}
+        self.pool_waits = 0
+
+    async def create_session(self):
+        if self._should_reset_connector:
+            await self.close()
+
+        if self._session is None or self._session.closed:
+            # Как в AiohttpSession, но с трассировкой пула соединений
+            self._session = ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+                trace_configs=[self._trace_config()],
+            )
+            self._should_reset_connector = False
+        return self._session
+
+    def _trace_config(self):
+        trace = TraceConfig()
+
+        async def on_queued_start(session, context, params):
+            context.queued_at = time.perf_counter()
+
+        async def on_queued_end(session, context, params):
+            self.pool_waits += 1
+            API_POOL_WAIT_SECONDS.observe(time.perf_counter() - context.queued_at)
+
+        async def on_create_end(session, context, params):
+            self.connections["new"] += 1
+            API_CONNECTIONS.inc("new")
+
+        async def on_reuseconn(session, context, params):
+            self.connections["reused"] += 1
+            API_CONNECTIONS.inc("reused")
+
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_connection_create_end.append(on_create_end)
+        trace.on_connection_reuseconn.append(on_reuseconn)
+        return trace
+
+    async def make_request(self, bot, method, timeout=None):
+        if timeout is None:
+            timeout = self.method_timeouts.get(method.__api_method__)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        API_IN_FLIGHT.set(self.in_flight)
+        try:
+            return await super().make_request(bot, method, timeout=timeout)
+        finally:
+            self.in_flight -= 1
+            API_IN_FLIGHT.set(self.in_flight)
+
+    def stats(self):
+        """Состояние пула для /health"""
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "pool_waits": self.pool_waits,
+            "connections": dict(self.connections),
+        }
+
+    def build_form_data(self, bot, method):
+        markup = getattr(method, "reply_markup", None)
+        if markup is None or id(markup) not in self.static_markups:
+            return super().build_form_data(bot, method)
+
+        serialized = self.markup_json.get(id(markup))
+        if serialized is None:
+            serialized = self.prepare_value(markup, bot=bot, files={})
+            self.markup_json[id(markup)] = serialized
+
+        form = super().build_form_data(bot, method.model_copy(update={"reply_markup": None}))
+        form.add_field("reply_markup", serialized)
+        return form
@@ -0,0 +1,615 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import cached_property
+
+from metrics import STORAGE_QUEUE_DEPTH, STORAGE_QUEUE_WAIT_SECONDS, STORAGE_SECONDS
+from timeparse import parse_time_range
+
+logger = logging.getLogger(__name__)
+
+# Структура таблицы записей
+HEADERS = ["Дни недели", "Время", "Имя пользователя", "Телеграм ID", "Телефон", "Ситуация", "Статус"]
+COLUMN_WIDTHS = [20, 20, 20, 15, 15, 30, 15]
+STATUS_PENDING = "Ожидает подтверждения"
+STATUS_CONFIRMED = "Подтверждена"
+STATUS_DECLINED = "Отклонена"
+STATUS_RESCHEDULE = "Требуется перенос"
+PENDING_COLOR = "FFB6C1"
+# Строки с этими статусами выделяются цветом, так как требуют действий
+HIGHLIGHTED_STATUSES = {STATUS_PENDING, STATUS_RESCHEDULE}
+
+# Запись на прием; record_id - номер строки в Excel или id в базе
+Booking = namedtuple("Booking", ["record_id", "day", "time_range", "username", "user_id", "phone", "situation", "status"])
+
+# openpyxl импортируется при первой работе с Excel, а не при запуске бота:
+# импорт занимает заметную часть холодного старта и не нужен для SQLite
+def load_workbook(*args, **kwargs):
+    from openpyxl import load_workbook as openpyxl_load_workbook
+    return openpyxl_load_workbook(*args, **kwargs)
+
+def new_workbook():
+    """Создает книгу с заголовками, шириной колонок и текстовым форматом ячеек"""
+    import openpyxl
+    from openpyxl.styles import NamedStyle
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Записи"
+
+    # Заголовки (измененные)
+    for col, header in enumerate(HEADERS, 1):
+        ws.cell(row=1, column=col, value=header)
+
+    # Устанавливаем ширину колонок
+    for col, width in enumerate(COLUMN_WIDTHS, 1):
+        col_letter = openpyxl.utils.get_column_letter(col)
+        ws.column_dimensions[col_letter].width = width
+
+    # Создаем стили для ячеек
+    text_style = NamedStyle(name="text_style", number_format='@')  # Текстовый формат
+
+    # Добавляем стили в книгу
+    if 'text_style' not in wb.named_styles:
+        wb.add_named_style(text_style)
+    return wb
+
+def minute_columns(time_range):
+    """Начало и конец диапазона в минутах для колонок базы (None, если не разобран)"""
+    interval = parse_time_range(str(time_range))
+    return interval if interval is not None else (None, None)
+
+# Создаем файл Excel если его нет
+def init_excel_file(file_path):
+    if not os.path.exists(file_path):
+        wb = new_workbook()
+        ws = wb.active
+
+        # Устанавливаем форматы для столбцов
+        for row in range(2, 100):  # Устанавливаем для большего количества строк
+            for col in range(1, 8):  # Все колонки текстовые
+                ws.cell(row=row, column=col).style = 'text_style'
+
+        wb.save(file_path)
+        logger.info("Excel файл создан с правильными форматами ячеек")
+
+# Интерфейс хранилища записей
+class BookingStorage:
+    """Базовый класс хранилища записей на прием"""
+
+    def load(self):
+        """Подготавливает хранилище к работе"""
+
+    def book_appointment(self, days_str, time_range_str, username, user_id, phone, situation):
+        """Сохраняет одну запись и возвращает список созданных Booking (пустой при ошибке)"""
+        raise NotImplementedError
+
+    def book_multiple_appointments(self, selected_days, days_with_times, username, user_id, phone, situation):
+        """Сохраняет отдельную запись для каждой пары день-время и возвращает созданные Booking"""
+        raise NotImplementedError
+
+    def update_status(self, record_id, status, user_id=None, day=None):
+        """Меняет статус записи по record_id и возвращает обновленную Booking.
+
+        Если заданы user_id и day, запись должна им соответствовать: иначе
+        на месте record_id уже другая запись и возвращается None, как для
+        отсутствующей записи.
+        """
+        raise NotImplementedError
+
+    def iter_records(self):
+        """Возвращает все записи в виде Booking"""
+        raise NotImplementedError
+
+    def iter_rows(self):
+        """Возвращает все записи в виде кортежей в порядке колонок HEADERS"""
+        for record in self.iter_records():
+            yield tuple(record[1:])
+
+    def flush(self):
+        """Сохраняет отложенные изменения"""
+
+    def close(self):
+        """Сохраняет изменения и освобождает ресурсы"""
+
+# Класс для работы с Excel
+class ExcelManager(BookingStorage):
+    def __init__(self, file_path, resident=False, flush_rows=50):
+        self.file_path = file_path
+        # В режиме resident книга загружается один раз и сохраняется пакетами
+        self.resident = resident
+        self.flush_rows = flush_rows
+        self.wb = None
+        self.pending_rows = 0
+        # Курсор следующей свободной строки и время последнего сохранения файла нами
+        self.next_row = None
+        self.saved_mtime = None
+
+    @cached_property
+    def red_fill(self):
+        from openpyxl.styles import PatternFill
+        return PatternFill(start_color=PENDING_COLOR, end_color=PENDING_COLOR, fill_type="solid")
+
+    @cached_property
+    def no_fill(self):
+        from openpyxl.styles import PatternFill
+        return PatternFill(fill_type=None)
+
+    def load(self):
+        """Создает файл при необходимости и загружает книгу в память (для режима resident)"""
+        init_excel_file(self.file_path)
+        if self.resident and self.wb is None:
+            with STORAGE_SECONDS.time("load_workbook"):
+                self.wb = load_workbook(self.file_path)
+            logger.info("Книга Excel загружена в память")
+        return self.wb
+
+    def _open_workbook(self):
+        if self.resident:
+            return self.wb if self.wb is not None else self.load()
+        # Если файл изменили вручную, курсор нужно найти заново
+        if os.path.getmtime(self.file_path) != self.saved_mtime:
+            self.next_row = None
+        with STORAGE_SECONDS.time("load_workbook"):
+            return load_workbook(self.file_path)
+
+    def _commit(self, wb, rows_count):
+        """Сохраняет изменения сразу или откладывает их до следующего сброса"""
+        if not self.resident:
+            with STORAGE_SECONDS.time("save"):
+                wb.save(self.file_path)
+            wb.close()
+            self.saved_mtime = os.path.getmtime(self.file_path)
+            return
+
+        self.pending_rows += rows_count
+        if self.pending_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """Сохраняет накопленные в памяти строки в файл"""
+        if self.wb is None or not self.pending_rows:
+            return
+        try:
+            with STORAGE_SECONDS.time("save"):
+                self.wb.save(self.file_path)
+            logger.info(f"В файл Excel сохранено новых строк: {self.pending_rows}")
+            self.pending_rows = 0
+        except Exception as e:
+            # Строки остаются в памяти и будут сохранены при следующем сбросе
+            logger.error(f"Ошибка при сохранении Excel: {e}")
+
+    def close(self):
+        """Принудительно сохраняет изменения и выгружает книгу из памяти"""
+        if self.wb is not None:
+            self.flush()
+            self.wb.close()
+            self.wb = None
+
+    def get_next_empty_row(self, ws):
+        """Возвращает следующую пустую строку, не просматривая таблицу заново"""
+        if self.next_row is None:
+            self.next_row = self._find_next_empty_row(ws)
+        return self.next_row
+
+    def _find_next_empty_row(self, ws):
+        """Находит строку после последней заполненной (один проход от конца листа)"""
+        # max_row учитывает и заранее оформленные пустые строки из init_excel_file,
+        # поэтому идем вверх до последней строки со значением
+        row = ws.max_row
+        while row > 1 and ws.cell(row=row, column=1).value is None:
+            row -= 1
+        return row + 1
+
+    def _write_row(self, ws, values):
+        """Записывает строку в первую свободную строку листа и возвращает запись"""
+        new_row = self.get_next_empty_row(ws)
+        values = [str(value) for value in values] + [STATUS_PENDING]  # Статус
+        for col, value in enumerate(values, 1):
+            ws.cell(row=new_row, column=col, value=value)
+
+        # Красим строку для визуального выделения
+        for col in range(1, 8):
+            ws.cell(row=new_row, column=col).fill = self.red_fill
+        self.next_row = new_row + 1
+        return Booking(new_row, *values)
+
+    def book_appointment(self, days_str, time_range_str, username, user_id, phone, situation):
+        """Записываем данные с днями недели и диапазоном времени"""
+        try:
+            wb = self._open_workbook()
+            ws = wb.active
+
+            record = self._write_row(ws, (days_str, time_range_str, username, user_id, phone, situation))
+
+            self._commit(wb, 1)
+            logger.info(f"Запись сохранена в строке {record.record_id}")
+            return [record]
+
+        except Exception as e:
+            logger.error(f"Ошибка при записи в Excel: {e}")
+            # Несохраненные строки могли сдвинуть курсор
+            self.next_row = None
+            return []
+
+    def book_multiple_appointments(self, selected_days, days_with_times, username, user_id, phone, situation):
+        """Создает отдельные записи для каждой пары день-время"""
+        try:
+            wb = self._open_workbook()
+            ws = wb.active
+
+            records = []
+
+            # Для каждого дня создаем отдельную запись
+            for day in selected_days:
+                time_range = days_with_times.get(day, "")
+                if time_range:
+                    record = self._write_row(ws, (day, time_range, username, user_id, phone, situation))
+                    records.append(record)
+                    logger.info(f"Запись для дня {day} сохранена в строке {record.record_id}")
+
+            self._commit(wb, len(records))
+            logger.info(f"Создано {len(records)} записей в Excel")
+            return records
+
+        except Exception as e:
+            logger.error(f"Ошибка при записи в Excel: {e}")
+            # Несохраненные строки могли сдвинуть курсор
+            self.next_row = None
+            return []
+
+    def update_status(self, record_id, status, user_id=None, day=None):
+        """Меняет статус в строке record_id без поиска по листу"""
+        try:
+            wb = self._open_workbook()
+            ws = wb.active
+            values = [ws.cell(row=record_id, column=col).value for col in range(1, 8)] if record_id >= 2 else [None]
+            if (
+                values[0] is None
+                or (user_id is not None and str(values[3]) != str(user_id))
+                or (day is not None and values[0] != day)
+            ):
+                logger.warning(f"Строка {record_id} для смены статуса не найдена или изменилась")
+                if not self.resident:
+                    wb.close()
+                return None
+
+            ws.cell(row=record_id, column=7, value=status)
+            fill = self.red_fill if status in HIGHLIGHTED_STATUSES else self.no_fill
+            for col in range(1, 8):
+                ws.cell(row=record_id, column=col).fill = fill
+            values[6] = status
+
+            self._commit(wb, 1)
+            logger.info(f"Статус записи в строке {record_id} изменен: {status}")
+            return Booking(record_id, *("" if value is None else str(value) for value in values))
+
+        except Exception as e:
+            logger.error(f"Ошибка при изменении статуса в Excel: {e}")
+            return None
+
+    def iter_records(self):
+        """Читает записи из файла потоково (read_only), без загрузки всей книги"""
+        if self.wb is not None:
+            self.flush()
+        wb = load_workbook(self.file_path, read_only=True)
+        try:
+            rows = wb.active.iter_rows(min_row=2, max_col=len(HEADERS), values_only=True)
+            for row_number, row in enumerate(rows, 2):
+                if row[0] is not None:
+                    values = ["" if value is None else str(value) for value in row]
+                    values += [""] * (len(HEADERS) - len(values))
+                    yield Booking(row_number, *values)
+        finally:
+            wb.close()
+
+# Хранилище записей в SQLite
+class SQLiteStorage(BookingStorage):
+    """Хранит записи в SQLite (режим WAL), Excel формируется выгрузкой"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = None
+
+    def load(self):
+        """Открывает базу и создает таблицу с индексами"""
+        if self.conn is None:
+            # Все обращения к базе идут через один поток записи
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS appointments ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "day TEXT NOT NULL, "
+                    "time_range TEXT NOT NULL, "
+                    "username TEXT NOT NULL, "
+                    "user_id TEXT NOT NULL, "
+                    "phone TEXT NOT NULL, "
+                    "situation TEXT NOT NULL, "
+                    "status TEXT NOT NULL, "
+                    "created_at TEXT NOT NULL, "
+                    "start_minute INTEGER, "
+                    "end_minute INTEGER)"
+                )
+                self._add_minute_columns()
+                self.conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_user_id ON appointments (user_id)")
+                self.conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_day ON appointments (day)")
+                self.conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_status ON appointments (status)")
+                self.conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_day_start ON appointments (day, start_minute)")
+            logger.info(f"База данных {self.db_path} открыта")
+        return self.conn
+
+    def _add_minute_columns(self):
+        """Добавляет в базу старого формата колонки времени в минутах и заполняет их"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(appointments)")}
+        if "start_minute" in columns:
+            return
+        self.conn.execute("ALTER TABLE appointments ADD COLUMN start_minute INTEGER")
+        self.conn.execute("ALTER TABLE appointments ADD COLUMN end_minute INTEGER")
+        rows = self.conn.execute("SELECT id, time_range FROM appointments").fetchall()
+        self.conn.executemany(
+            "UPDATE appointments SET start_minute = ?, end_minute = ? WHERE id = ?",
+            ((*minute_columns(time_range), row_id) for row_id, time_range in rows)
+        )
+        logger.info(f"Добавлены колонки времени в минутах, заполнено записей: {len(rows)}")
+
+    def insert_rows(self, rows):
+        """Добавляет записи одной транзакцией и возвращает их в виде Booking"""
+        conn = self.load()
+        created_at = datetime.now().isoformat(timespec="seconds")
+        records = []
+        with STORAGE_SECONDS.time("sqlite_insert"), conn:
+            for row in rows:
+                values = [str(value) for value in row]
+                cursor = conn.execute(
+                    "INSERT INTO appointments "
+                    "(day, time_range, username, user_id, phone, situation, status, created_at, "
+                    "start_minute, end_minute) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*values, created_at, *minute_columns(values[1]))
+                )
+                records.append(Booking(cursor.lastrowid, *values))
+        return records
+
+    def insert_batch(self, rows):
+        """Добавляет пачку записей одной транзакцией без чтения их ID (массовая загрузка)"""
+        with self.load():
+            return _insert_migrated(self, rows)
+
+    def book_appointment(self, days_str, time_range_str, username, user_id, phone, situation):
+        """Записываем данные с днями недели и диапазоном времени"""
+        try:
+            records = self.insert_rows([(days_str, time_range_str, username, user_id, phone, situation, STATUS_PENDING)])
+            logger.info("Запись сохранена в базе данных")
+            return records
+        except Exception as e:
+            logger.error(f"Ошибка при записи в базу данных: {e}")
+            return []
+
+    def book_multiple_appointments(self, selected_days, days_with_times, username, user_id, phone, situation):
+        """Создает отдельные записи для каждой пары день-время в одной транзакции"""
+        rows = [
+            (day, days_with_times[day], username, user_id, phone, situation, STATUS_PENDING)
+            for day in selected_days if days_with_times.get(day)
+        ]
+        try:
+            records = self.insert_rows(rows) if rows else []
+            logger.info(f"Создано {len(records)} записей в базе данных")
+            return records
+        except Exception as e:
+            logger.error(f"Ошибка при записи в базу данных: {e}")
+            return []
+
+    def update_status(self, record_id, status, user_id=None, day=None):
+        conn = self.load()
+        where, params = "id = ?", [record_id]
+        if user_id is not None:
+            where += " AND user_id = ?"
+            params.append(str(user_id))
+        if day is not None:
+            where += " AND day = ?"
+            params.append(day)
+        try:
+            with STORAGE_SECONDS.time("sqlite_update"), conn:
+                updated = conn.execute(f"UPDATE appointments SET status = ? WHERE {where}", (status, *params)).rowcount
+            row = conn.execute(
+                "SELECT id, day, time_range, username, user_id, phone, situation, status "
+                "FROM appointments WHERE id = ?", (record_id,)
+            ).fetchone() if updated else None
+        except Exception as e:
+            logger.error(f"Ошибка при изменении статуса в базе данных: {e}")
+            return None
+        if row is None:
+            logger.warning(f"Запись {record_id} для смены статуса не найдена или изменилась")
+            return None
+        logger.info(f"Статус записи {record_id} изменен: {status}")
+        return Booking(*row)
+
+    def iter_records(self):
+        cursor = self.load().execute(
+            "SELECT id, day, time_range, username, user_id, phone, situation, status "
+            "FROM appointments ORDER BY id"
+        )
+        for row in cursor:
+            yield Booking(*row)
+
+    def iter_rows(self):
+        cursor = self.load().execute(
+            "SELECT day, time_range, username, user_id, phone, situation, status "
+            "FROM appointments ORDER BY id"
+        )
+        yield from cursor
+
+    def count(self):
+        return self.load().execute("SELECT COUNT(*) FROM appointments").fetchone()[0]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def export_to_excel(rows, file_path):
+    """Потоково формирует файл Excel с записями в формате ExcelManager.
+
+    Книга открывается в режиме write-only: строки из итератора сразу пишутся
+    в файл, поэтому расход памяти не зависит от количества записей.
+    """
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import PatternFill
+
+    tmp_path = file_path + ".tmp"
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Записи")
+
+    # Ширину колонок можно задать только до первой строки
+    for col, width in enumerate(COLUMN_WIDTHS, 1):
+        ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = width
+    ws.append(HEADERS)
+
+    # Строка сериализуется сразу при append, поэтому окрашенные ячейки
+    # создаются один раз и переиспользуются для всех строк
+    red_fill = PatternFill(start_color=PENDING_COLOR, end_color=PENDING_COLOR, fill_type="solid")
+    pending_cells = [WriteOnlyCell(ws) for _ in HEADERS]
+    for cell in pending_cells:
+        cell.fill = red_fill
+
+    count = 0
+    for count, row in enumerate(rows, 1):
+        if row[6] in HIGHLIGHTED_STATUSES:
+            # Красим строки, ожидающие решения, как ExcelManager
+            for cell, value in zip(pending_cells, row):
+                cell.value = value
+            ws.append(pending_cells)
+        else:
+            ws.append(row)
+    wb.save(tmp_path)
+    # Подменяем файл целиком, чтобы никто не увидел недописанную выгрузку
+    os.replace(tmp_path, file_path)
+    logger.info(f"Выгружено {count} записей в {file_path}")
+    return count
+
+def migrate_excel_to_sqlite(excel_path, db_path, batch_size=1000):
+    """Однократно переносит записи из appointments.xlsx в базу SQLite"""
+    db = SQLiteStorage(db_path)
+    try:
+        if db.count():
+            logger.warning(f"В базе {db_path} уже есть записи, перенос пропущен")
+            return 0
+
+        source = ExcelManager(excel_path)
+        total = 0
+        batch = []
+        # Весь перенос выполняется одной транзакцией
+        with db.load():
+            for row in source.iter_rows():
+                batch.append(tuple(row) + ("",) * (len(HEADERS) - len(row)))
+                if len(batch) >= batch_size:
+                    total += _insert_migrated(db, batch)
+                    batch = []
+            if batch:
+                total += _insert_migrated(db, batch)
+        logger.info(f"Перенесено {total} записей из {excel_path} в {db_path}")
+        return total
+    finally:
+        db.close()
+
+def _insert_migrated(db, rows):
+    created_at = datetime.now().isoformat(timespec="seconds")
+    db.conn.executemany(
+        "INSERT INTO appointments "
+        "(day, time_range, username, user_id, phone, situation, status, created_at, "
+        "start_minute, end_minute) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ((*row, created_at, *minute_columns(row[1])) for row in rows)
+    )
+    return len(rows)
+
+def create_booking_storage():
+    """Создает хранилище записей по переменным окружения"""
+    backend = os.getenv("STORAGE_BACKEND", "excel")
+    if backend == "sqlite":
+        return SQLiteStorage(os.getenv("SQLITE_FILE", "appointments.db"))
+    return ExcelManager(
+        os.getenv("EXCEL_FILE", "appointments.xlsx"),
+        resident=os.getenv("EXCEL_RESIDENT", "0") == "1",
+        flush_rows=int(os.getenv("EXCEL_FLUSH_ROWS", "50"))
+    )
+
+# Фоновая запись в хранилище
+class StorageWriteWorker:
+    """Выполняет операции с хранилищем в отдельном потоке, не блокируя цикл событий"""
+    def __init__(self):
+        # Один поток-владелец хранилища: записи выполняются строго по очереди
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage-writer")
+        self.queue = None
+        self.task = None
+        self.total_writes = 0
+        self.max_queue_depth = 0
+        self.max_write_time = 0.0
+
+    def start(self):
+        """Запускает обработчик очереди в текущем цикле событий"""
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def submit(self, func, *args):
+        """Ставит операцию в очередь и ожидает ее результат"""
+        if self.queue is None:
+            self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        queue_depth = self.queue.qsize()
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth + 1)
+        await self.queue.put((func, args, future, queue_depth, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args, future, queue_depth, enqueued_at = await self.queue.get()
+            started_at = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self.executor, func, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                finished_at = time.perf_counter()
+                write_time = finished_at - started_at
+                STORAGE_QUEUE_DEPTH.set(queue_depth)
+                STORAGE_QUEUE_WAIT_SECONDS.observe(started_at - enqueued_at)
+                self.total_writes += 1
+                self.max_write_time = max(self.max_write_time, write_time)
+                logger.info(
+                    f"Запись в хранилище: очередь перед запросом {queue_depth}, "
+                    f"ожидание {(started_at - enqueued_at) * 1000:.1f} мс, "
+                    f"запись {write_time * 1000:.1f} мс"
+                )
+                self.queue.task_done()
+
+    async def stop(self):
+        """Дожидается выполнения всех операций из очереди и останавливает поток записи"""
+        if self.queue is not None:
+            await self.queue.join()
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+        logger.info(
+            f"Поток записи остановлен: записей {self.total_writes}, "
+            f"макс. очередь {self.max_queue_depth}, "
+            f"макс. время записи {self.max_write_time * 1000:.1f} мс"
+        )
@@ -0,0 +1,40 @@
+import re
+from functools import lru_cache
+
+# Диапазон времени: 9:00-12:00, 9-12, 9.00–12.00, «с 9 до 12».
+# Минуты необязательны, разделитель - дефис, короткое или длинное тире либо «до»
+_TIME = r"(\d{1,2})(?:[:.](\d{2}))?"
+TIME_RANGE_RE = re.compile(
+    rf"(?:с\s*)?{_TIME}\s*(?:[-–—]|до)\s*{_TIME}",
+    re.IGNORECASE
+)
+
+def _minutes(hours, minutes):
+    hours = int(hours)
+    minutes = int(minutes) if minutes else 0
+    if hours > 24 or minutes > 59 or (hours == 24 and minutes):
+        return None
+    return hours * 60 + minutes
+
+@lru_cache(maxsize=4096)
+def parse_time_range(text):
+    """Переводит диапазон времени в минуты от начала суток (start, end).
+
+    Возвращает None, если текст не похож на диапазон. Порядок границ
+    не проверяется: start >= end обрабатывает вызывающий код.
+    """
+    match = TIME_RANGE_RE.fullmatch(text.strip())
+    if match is None:
+        return None
+    start = _minutes(match.group(1), match.group(2))
+    end = _minutes(match.group(3), match.group(4))
+    if start is None or end is None or start == 24 * 60:
+        return None
+    return start, end
+
+def format_minutes(minutes):
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+def format_time_range(interval):
+    """Записывает диапазон в едином виде ЧЧ:MM-ЧЧ:MM"""
+    return f"{format_minutes(interval[0])}-{format_minutes(interval[1])}"